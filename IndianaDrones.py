@@ -1,6 +1,8 @@
+import argparse
 import math
 import os
 import mathutils
+import numpy as np
 
 import bpy
 
@@ -8,25 +10,42 @@ def getLocalFolder():
     path = str(os.path.dirname(os.path.abspath(__file__))).split(os.sep)
     return (os.sep).join(path[:len(path)-1])
 
+def default_local_folder():
+    """Folder of this script, holding the assets and the sample log; run from a text
+    block inside a .blend, the folder of that .blend"""
+    folder = os.path.dirname(os.path.abspath(__file__))
+    return folder if os.path.isdir(folder) else getLocalFolder()
+
 import sys
 sys.path.append(getLocalFolder())
 
+import geometry
 import mybpy
+import profiling
+import registry
+import rendercache
+import sceneplan
+import simlog
 
 from importlib import reload  # Python 3.4+
+geometry = reload(geometry)
+profiling = reload(profiling)
 mybpy = reload(mybpy)
-
-import json
+registry = reload(registry)
+rendercache = reload(rendercache)
+simlog = reload(simlog)
+sceneplan = reload(sceneplan)
 
 
 class IndianaDrones:
     
-    def __init__(self):
+    def __init__(self, local_folder=None, *, cache_folder=None):
         
-        self.local_folder = 'C:\\Users\\Shadow\\Documents\\Blender Indiana Drones\\'
-        self.trees_filepath = self.local_folder + '\\Trees\\trees9.obj'
+        self.local_folder = local_folder or default_local_folder()
+        self.cache_folder = cache_folder or self.local_folder # shared by the hosts of a farm
+        self.trees_filepath = os.path.join(self.local_folder, 'Trees', 'trees9.obj')
         
-        self.robot_filepath = self.local_folder + 'DRON 001.fbx'
+        self.robot_filepath = os.path.join(self.local_folder, 'DRON 001.fbx')
         self.robot_name = 'Robot'
         self.robot_high = 3.2
         self.robot_frames_rotation = 3
@@ -36,10 +55,13 @@ class IndianaDrones:
         self.camera_name = 'Camera'
         self.camera_rotation_euler = (0, 0, 0)
         self.camera_location = (35, -10, 250)
-#        self.camera_rotation_euler = (0.3, 0, 0.3)
-#        self.camera_location = (50, -80, 250)
-#        self.camera_rotation_euler = (mybpy.degree2radians(83), 0, mybpy.degree2radians(75))
-#        self.camera_location = (150, -39.5, 21)
+        self.camera_rigs = {
+            'top': {'location': (35, -10, 250), 'rotation_euler': (0, 0, 0)},
+            'angled': {'location': (50, -80, 250), 'rotation_euler': (0.3, 0, 0.3)},
+            'side': {'location': (150, -39.5, 21),
+                     'rotation_euler': (mybpy.degree2radians(83), 0, mybpy.degree2radians(75))},
+        }
+        self.render_cameras = None # rigs rendered from each scene build, None for the scene camera only
         
         self.sun_name = 'Sun'
         self.sun_energy = 1
@@ -57,6 +79,13 @@ class IndianaDrones:
         self.path_wide = 3.
         self.path_thick = .1
         self.path_color = (0.8, 0.04, 0.04, 1)
+        self.path_mode = 'mesh' # 'mesh': single mesh, 'curve': persistent beveled curve,
+                                # 'booleans': one cylinder/cube per segment
+        self.path_reveal_frames = 6 # with a curve lane, frames over which it grows along the route
+        self.path_tolerance = .1 # largest lane deviation when simplifying, as a fraction of path_wide
+        self.lane_name = None
+        self.lane_geometry = None # (points, blocks) last written to a lane laid out in blocks
+        self.scene_update = 'rebuild' # 'incremental': diff each take against the scene in place
         
         self.tree_letter_to_name = {
             'A': 'Bark___S',
@@ -90,14 +119,53 @@ class IndianaDrones:
             'Sonnerat': (-40,0,0),
             'Oak_Leav': (-50,0,0),
         }
+        self.trees_linked = True # clones share the template mesh instead of copying it
+        self.use_tree_lod = True
+        self.tree_lod_ratios = (1., .2, .04) # decimation ratio per level of detail
+        self.tree_lod_texture_sizes = (None, 512, 128) # longest texture side per level
+        self.tree_lod_pixel_thresholds = (150, 40) # on-screen width needed for levels 0 and 1
+        self.tree_move_tolerance = .01 # smaller position changes between takes are ignored
+        self.use_culling = True # skip obstacles outside the camera view or off the floor
+        self.culling_margin = 10. # scene units kept around the view, so crowns at the edge stay
+        self.obstacle_index = geometry.GridIndex(cell_size=20.)
+        self.type_table = []
+        self.tree_types = None # (tree index per obstacle type code, tree names)
+        self.tree_clone_sources = {} # (tree name, level): object to clone
+        self.placed_obstacles = simlog.make_obstacles([], [], np.zeros((0, 2)), [])
+        self.placed_tree_names = np.zeros(0, dtype=object)
         self.imported_trees_names = set()
+        self.registry = registry.ObjectRegistry()
+        self.registry.rebuild()
         self.are_trees_imported()
+        self.register_untagged_objects()
         
-        self.sim_filepath = self.local_folder + 'coordinates.json'
+        self.asset_cache_folder = os.path.join(self.cache_folder, 'asset_cache')
+        self.use_asset_cache = True # imported FBX/OBJ saved once as .blend libraries
+        
+        self.sim_filepath = os.path.join(self.local_folder, 'coordinates.json')
         self.sim_scale = 10.
         self.sim_fps = 10
         self.sim_data = None
         
+        self.render_cache_folder = os.path.join(self.cache_folder, 'render_cache')
+        self.use_render_cache = True
+        self.render_cache = None
+        self.render_resumable = False # checkpointed frame sequence instead of a direct MP4
+        self.render_profiles = {
+            # quick checks on CPU-only headless boxes: few samples, direct light only
+            'draft': {'engine': 'CYCLES', 'resolution_percentage': 25, 'cycles_samples': 4,
+                      'device': 'CPU', 'cycles_bounces': 0, 'use_diffuse_light': False},
+            'preview': {'engine': 'CYCLES', 'resolution_percentage': 50, 'cycles_samples': 16,
+                        'device': 'CPU', 'use_diffuse_light': False},
+            'final': {}, # the settings saved in the .blend
+            # opt-in, Workbench needs an OpenGL context even with -b
+            'workbench': {'engine': 'BLENDER_WORKBENCH', 'resolution_percentage': 50,
+                          'workbench_aa': 'FXAA', 'use_diffuse_light': False},
+        }
+        self.render_profile = 'final'
+        self.take_render_profiles = {} # take: profile name, overriding render_profile
+        self.base_render_quality = None
+        
         
     def create_camera(self):
         if not mybpy.is_object_in_scene(self.camera_name):
@@ -105,22 +173,93 @@ class IndianaDrones:
                 rotation_euler=self.camera_rotation_euler, object_name=self.camera_name)
             
             
+    def get_rig_camera_name(self, rig):
+        return self.camera_name + '_' + rig
+            
+            
+    def create_camera_rigs(self):
+        for rig in (self.render_cameras or ()):
+            if not mybpy.is_object_in_scene(self.get_rig_camera_name(rig)):
+                mybpy.create_camera(object_name=self.get_rig_camera_name(rig), set_active=False,
+                    **self.camera_rigs[rig])
+                
+                
+    def get_render_camera_objects(self):
+        """Cameras the scene is rendered from, which culling and detail must serve"""
+        if self.render_cameras:
+            return [mybpy.get_object(self.get_rig_camera_name(rig)) for rig in self.render_cameras]
+        camera = bpy.context.scene.camera
+        return [] if camera is None else [camera]
+            
+            
+    def render_with_cameras(self, render):
+        """Call render(suffix) once per render camera, all from the same scene build.
+        Persistent data lets Cycles keep the BVH and compiled shaders between views."""
+        if not self.render_cameras: return [render('')]
+        scene = bpy.context.scene
+        saved = (scene.camera, scene.render.use_persistent_data)
+        scene.render.use_persistent_data = True
+        outputs = []
+        try:
+            for rig in self.render_cameras:
+                scene.camera = mybpy.get_object(self.get_rig_camera_name(rig))
+                outputs.append(render('_' + rig))
+        finally:
+            scene.camera, scene.render.use_persistent_data = saved
+        return outputs
+            
+            
     def are_trees_imported(self):
-        are_imported = False
-        objects_in_scene = mybpy.get_all_objects_names()
-        for o in objects_in_scene:
-            if mybpy.get_object(o).hide_render == True:
-                self.imported_trees_names.add(o)
-                are_imported = True
+        templates = self.registry.names(registry.ROLE_TREE_TEMPLATE)
+        if len(templates) == 0:
+            # scene saved before objects were tagged: hidden objects are the templates
+            for o in mybpy.get_all_objects_names():
+                if mybpy.get_object(o).hide_render == True:
+                    templates.add(o)
+            self.register_tree_templates(templates)
             
-        return are_imported
+        self.imported_trees_names |= templates
+        return len(templates) > 0
+        
+        
+    def register_untagged_objects(self):
+        """Tag the lanes and cloned trees of a scene saved before objects were tagged,
+        matching them by name as before, so the next update removes them"""
+        for o in mybpy.get_all_objects_names():
+            if self.registry.role(o) is not None: continue
+            if 'Path_' in o:
+                self.registry.register(o, registry.ROLE_PATH)
+            elif any(t in o for t in self.trees_origins.keys()) \
+                    and not mybpy.get_object(o).hide_render:
+                self.registry.register(o, registry.ROLE_TREE)
+        
+        
+    def register_tree_templates(self, object_names):
+        """Resolve each tree type to its imported object once"""
+        self.tree_clone_sources = {}
+        for tree_name in self.trees_origins.keys():
+            found_candidates = [o for o in object_names if tree_name in o]
+            if len(found_candidates) > 0:
+                self.registry.register(found_candidates[0], registry.ROLE_TREE_TEMPLATE,
+                    tree_type=tree_name)
         
 
+    @profiling.profiled
     def import_trees(self, force_import=False):
         
         if (force_import) or (not self.are_trees_imported()):
             
+            library_filepath = self.asset_library_filepath('trees',
+                [self.trees_filepath, os.path.splitext(self.trees_filepath)[0] + '.mtl'],
+                {'trees_origins': self.trees_origins})
+            if self.use_asset_cache and os.path.exists(library_filepath):
+                # hidden and with origins already normalized
+                self.imported_trees_names = set(mybpy.load_library(library_filepath))
+                self.register_tree_templates(self.imported_trees_names)
+                return
+            
             self.imported_trees_names = set(mybpy.import_obj(self.trees_filepath))
+            self.register_tree_templates(self.imported_trees_names)
                 
             # hide all imported trees
             for imported_tree in self.imported_trees_names:
@@ -132,8 +271,85 @@ class IndianaDrones:
                 tree_fullname = self.get_tree_fullname(tree_name)
                 mybpy.get_object(tree_fullname).data.transform(
                     mathutils.Matrix.Translation(new_origin))
+                    
+            if self.use_asset_cache:
+                mybpy.save_library(library_filepath, self.imported_trees_names)
+                
+                
+    def asset_library_filepath(self, name, source_filepaths, parameters=None):
+        """Library file for converted assets, named after a digest of their sources"""
+        digest = rendercache.data_digest({
+            'sources': [rendercache.file_digest(f) for f in source_filepaths if os.path.exists(f)],
+            'parameters': parameters,
+        })
+        return os.path.join(self.asset_cache_folder, name + '-' + digest[:16] + '.blend')
     
     
+    def get_tree_lod_name(self, tree_name, level):
+        tree_fullname = self.get_tree_fullname(tree_name)
+        return tree_fullname if level == 0 else tree_fullname + '_LOD' + str(level)
+        
+        
+    @profiling.profiled
+    def import_tree_lods(self):
+        """Decimated meshes and downscaled textures for every tree type, cached on disk"""
+        lod_names = [self.get_tree_lod_name(tree_name, level)
+            for tree_name in self.trees_origins.keys() if self.get_tree_fullname(tree_name)
+            for level in range(1, len(self.tree_lod_ratios))]
+        if all(mybpy.is_object_in_scene(n) for n in lod_names): return
+        
+        library_filepath = self.asset_library_filepath('trees_lod',
+            [self.trees_filepath, os.path.splitext(self.trees_filepath)[0] + '.mtl'],
+            {'trees_origins': self.trees_origins, 'ratios': self.tree_lod_ratios,
+             'texture_sizes': self.tree_lod_texture_sizes})
+        if self.use_asset_cache and os.path.exists(library_filepath):
+            mybpy.load_library(library_filepath, lod_names)
+            self.register_tree_lods()
+            return
+            
+        texture_folder = os.path.join(self.asset_cache_folder, 'textures')
+        for tree_name in self.trees_origins.keys():
+            tree_fullname = self.get_tree_fullname(tree_name)
+            if tree_fullname is None: continue
+            for level in range(1, len(self.tree_lod_ratios)):
+                lod_name = mybpy.decimate_object(tree_fullname, self.tree_lod_ratios[level],
+                    new_object_name=self.get_tree_lod_name(tree_name, level))
+                if self.tree_lod_texture_sizes[level]:
+                    mybpy.use_texture_proxies(lod_name, self.tree_lod_texture_sizes[level],
+                        texture_folder)
+                    
+        self.register_tree_lods()
+        if self.use_asset_cache: mybpy.save_library(library_filepath, lod_names)
+        
+        
+    def register_tree_lods(self):
+        # LOD objects are copies of the templates, so they must not keep the template tag
+        self.tree_clone_sources = {}
+        for tree_name in self.trees_origins.keys():
+            if self.get_tree_fullname(tree_name) is None: continue
+            for level in range(1, len(self.tree_lod_ratios)):
+                lod_name = self.get_tree_lod_name(tree_name, level)
+                if mybpy.is_object_in_scene(lod_name):
+                    self.registry.register(lod_name, registry.ROLE_TREE_LOD, tree_type=tree_name)
+        
+        
+    def get_tree_lod_levels(self, locations, sizes):
+        """Level of detail per tree from its largest projected size in the render cameras"""
+        cameras = self.get_render_camera_objects()
+        if (not self.use_tree_lod) or (not cameras) or len(locations) == 0:
+            return np.zeros(len(locations), dtype=int)
+        render = bpy.context.scene.render
+        pixels = np.zeros(len(locations))
+        for camera in cameras:
+            distances = np.linalg.norm(np.asarray(locations) - np.asarray(camera.location), axis=1)
+            pixels = np.maximum(pixels, geometry.projected_size(sizes, distances, lens=camera.data.lens,
+                sensor_width=camera.data.sensor_width,
+                resolution_x=render.resolution_x * render.resolution_percentage / 100.,
+                ortho_scale=camera.data.ortho_scale if camera.data.type == 'ORTHO' else None))
+        levels = geometry.select_lod(pixels, self.tree_lod_pixel_thresholds)
+        return np.minimum(levels, len(self.tree_lod_ratios) - 1)
+        
+        
     def coords_to_location(self, coords, z=0):
         return [c for c in coords] + [z]
     
@@ -142,12 +358,22 @@ class IndianaDrones:
         return self.coords_to_location(coords, self.robot_high)
 
 
+    @profiling.profiled
     def import_robot(self):
         if not mybpy.is_object_in_scene(self.robot_name):
             location = self.robot_coords_to_location([20, -10])
             heading = -30 * math.pi / 180
-            self.robot_name = mybpy.import_fbx(self.robot_filepath, object_name=self.robot_name,
-                location=location, rotation_euler=(0, math.pi/2, heading))
+            library_filepath = self.asset_library_filepath('robot', [self.robot_filepath],
+                {'object_name': self.robot_name})
+            if self.use_asset_cache and os.path.exists(library_filepath):
+                loaded_names = mybpy.load_library(library_filepath)
+                self.robot_name = next(n for n in loaded_names if mybpy.get_object(n).parent is None)
+            else:
+                self.robot_name = mybpy.import_fbx(self.robot_filepath, object_name=self.robot_name,
+                    location=location, rotation_euler=(0, math.pi/2, heading))
+                if self.use_asset_cache:
+                    mybpy.save_library(library_filepath, mybpy.get_hierarchy_names(self.robot_name))
+            self.registry.register(self.robot_name, registry.ROLE_ROBOT)
             
             
     def set_robot_position(self, coords, heading):
@@ -174,77 +400,179 @@ class IndianaDrones:
             self.floor_name = mybpy.add_plane(self.floor_size, object_name=self.floor_name)
         
         
+    @profiling.profiled
     def load_objects(self, clear_objects=False):
         if clear_objects: mybpy.delete_all_objects()
         self.create_camera()
+        self.create_camera_rigs()
         self.create_floor()
         self.import_robot()
         self.create_sun()
         self.create_light()
         self.import_trees()
+        if self.use_tree_lod: self.import_tree_lods()
+        
+        
+    @profiling.profiled
+    def reset_dynamic_objects(self):
+        """Remove the lane, the cloned trees and the robot keys, keeping the static scene"""
+        self.delete_path()
+        self.delete_cloned_trees()
+        if mybpy.is_object_in_scene(self.robot_name): self.clear_robot_animation()
+        
+        
+    def clear_robot_animation(self):
+        robot = mybpy.get_object(self.robot_name)
+        action = robot.animation_data.action if robot.animation_data else None
+        robot.animation_data_clear()
+        # the next keys go to a new action, so free this one or long runs leak one each time
+        if action is not None: mybpy.free_orphans([action])
         
         
     def create_robot_translation(self, from_coords, to_coords):
-        from_location = self.robot_coords_to_location(from_coords)
-        to_location = self.robot_coords_to_location(to_coords)
-        frames_locations = {self.robot_frames_rotation: from_location, 
-            self.robot_frames_rotation + self.robot_frames_translation: to_location}
-        mybpy.add_keyframe_sequence(self.robot_name, 'location', frames_locations)
+        frames = (self.robot_frames_rotation, self.robot_frames_total)
+        locations = (self.robot_coords_to_location(from_coords),
+                     self.robot_coords_to_location(to_coords))
+        mybpy.add_keyframes(self.robot_name, 'location', frames, locations)
         
         
     def create_robot_rotation(self, from_heading, to_heading):
-        frames_rotations = {0: (0, math.pi/2, from_heading),
-                            self.robot_frames_rotation:(0, math.pi/2, to_heading)}
-        mybpy.add_keyframe_sequence(self.robot_name, 'rotation_euler', frames_rotations)
+        frames = (0, self.robot_frames_rotation)
+        rotations = ((0, math.pi/2, from_heading), (0, math.pi/2, to_heading))
+        mybpy.add_keyframes(self.robot_name, 'rotation_euler', frames, rotations)
         
 
     def create_tree_appearance(self, tree_name):
-        frames_locations = {0: True, 2: False}
-        mybpy.add_keyframe_sequence(tree_name, 'hide_viewport', frames_locations)
-        mybpy.add_keyframe_sequence(tree_name, 'hide_render', frames_locations)
+        frames, hidden = (0, 2), (True, False)
+        mybpy.add_keyframes(tree_name, 'hide_viewport', frames, hidden, interpolation='CONSTANT')
+        mybpy.add_keyframes(tree_name, 'hide_render', frames, hidden, interpolation='CONSTANT')
 
 
+    @profiling.profiled
     def create_path(self, coords2D = ((0, 0), (4, 0), (4, -4), (10, -10), (20, -10))):
+        if self.path_mode == 'curve': return self.update_lane_curve(coords2D)
         self.delete_path()
-        return mybpy.create_lane_on_floor(coords2D, wide=self.path_wide,
+        coords2D = self.simplify_path(coords2D)
+        if self.path_mode == 'mesh':
+            vertices, faces = geometry.lane_mesh(coords2D, self.path_wide, self.path_thick)
+            return [self.create_lane(coords2D, vertices, faces)]
+        
+        path_object_names = mybpy.create_lane_on_floor(coords2D, wide=self.path_wide,
             thick=self.path_thick, color=self.path_color, object_name=self.path_name)
+        for path_object_name in path_object_names:
+            self.registry.register(path_object_name, registry.ROLE_PATH)
+        return path_object_names
+        
+        
+    def create_lane(self, points, vertices, faces):
+        """Lane object from a simplified path and its mesh arrays"""
+        self.lane_name = mybpy.create_mesh(vertices, faces, object_name=self.path_name + '_Lane',
+            color=self.path_color)
+        self.registry.register(self.lane_name, registry.ROLE_PATH)
+        return self.lane_name
+        
+        
+    def create_lane_blocks(self, points, blocks):
+        """Lane object laid out in blocks (geometry.lane_blocks), so later takes can patch it"""
+        self.delete_path()
+        blocks = pad_lane_blocks(blocks, max(len(blocks), 1))
+        self.lane_name = mybpy.create_mesh(blocks.reshape(-1, 3), geometry.lane_block_faces(len(blocks)),
+            object_name=self.path_name + '_Lane', color=self.path_color)
+        self.lane_geometry = (points, blocks)
+        self.registry.register(self.lane_name, registry.ROLE_PATH)
+        return self.lane_name
             
             
+    @profiling.profiled
+    def update_path(self, coords2D):
+        """Patch the lane mesh in place, writing only the segments that changed since the last take"""
+        if self.path_mode != 'mesh': return self.create_path(coords2D)
+        
+        coords2D = self.simplify_path(coords2D)
+        if self.has_lane() and self.is_lane_unchanged(coords2D): return [self.lane_name]
+        blocks = geometry.lane_blocks(coords2D, self.path_wide, self.path_thick)
+        if not self.has_lane(): return [self.create_lane_blocks(coords2D, blocks)]
+        return [self.patch_lane(coords2D, blocks)]
+        
+        
+    @profiling.profiled
+    def update_lane_curve(self, coords2D):
+        """Lane as one curve object kept across takes, its points rewritten in place"""
+        coords2D = geometry.remove_repeated_points(self.simplify_path(coords2D))
+        if self.lane_name is None or self.lane_name not in self.registry.names(registry.ROLE_PATH) \
+                or not mybpy.is_object_in_scene(self.lane_name) \
+                or mybpy.get_object(self.lane_name).type != 'CURVE':
+            self.delete_path()
+            self.lane_name = mybpy.create_lane_curve(coords2D, wide=self.path_wide,
+                thick=self.path_thick, color=self.path_color, object_name=self.path_name + '_Lane')
+            self.registry.register(self.lane_name, registry.ROLE_PATH)
+        else:
+            mybpy.set_curve_points(mybpy.get_object(self.lane_name).data, coords2D)
+        
+        if self.path_reveal_frames:
+            mybpy.add_keyframes(self.lane_name, 'data.bevel_factor_end',
+                (0, self.path_reveal_frames), (0., 1.), interpolation='LINEAR')
+        return [self.lane_name]
+        
+        
+    def has_lane(self):
+        return self.path_mode == 'mesh' and self.lane_geometry is not None \
+            and self.lane_name in self.registry.names(registry.ROLE_PATH) \
+            and mybpy.is_object_in_scene(self.lane_name)
+        
+        
+    def is_lane_unchanged(self, points):
+        previous_points = self.lane_geometry[0]
+        return len(previous_points) == len(points) and np.allclose(previous_points, points)
+        
+        
+    def patch_lane(self, points, blocks):
+        """Write into the lane mesh only the blocks that differ from the last take.
+        Blocks count from the tail, so a path that lost points at its front rewrites
+        its new first segment and collapses the dropped ones; the rest is untouched."""
+        mesh = mybpy.get_object(self.lane_name).data
+        previous_blocks = self.lane_geometry[1]
+        if len(blocks) > len(previous_blocks):
+            # out of spare blocks: grow the mesh, doubling so this stays rare
+            blocks = pad_lane_blocks(blocks, max(len(blocks), 2 * len(previous_blocks)))
+            mybpy.set_mesh_geometry(mesh, blocks.reshape(-1, 3), geometry.lane_block_faces(len(blocks)))
+        else:
+            blocks = pad_lane_blocks(blocks, len(previous_blocks))
+            changed = np.flatnonzero(np.any(blocks != previous_blocks, axis=(1, 2)))
+            mybpy.set_mesh_vertex_blocks(mesh, blocks, changed)
+        self.lane_geometry = (points, blocks)
+        return self.lane_name
+        
+        
+    def simplify_path(self, coords2D):
+        """Drop nearly collinear points, in scene units, keeping the lane within tolerance"""
+        if not self.path_tolerance: return coords2D
+        return geometry.simplify_path(coords2D, self.path_tolerance * self.path_wide)
+        
+        
     def delete_path(self):
-        objects_in_scene = bpy.context.scene.objects.keys()
-        for o in objects_in_scene:
-            if 'Path_' in o: mybpy.delete_objects([o])
+        self.delete_registered(registry.ROLE_PATH)
+        self.lane_name = None
+        self.lane_geometry = None
+        
+        
+    def delete_registered(self, role):
+        object_names = self.registry.names(role)
+        mybpy.delete_objects([o for o in object_names if mybpy.is_object_in_scene(o)])
+        for o in object_names:
+            self.registry.unregister(o)
             
         
+    @profiling.profiled
     def load_simulation(self):
-        self.sim_data = []
-        for line in open(self.sim_filepath, 'r'):
-            new_sim_data = json.loads(line)
-            
-            # scale values from simulation to Blender scene 
-            for sim_obj_name, sim_attrs in new_sim_data.items():
-                if sim_obj_name == 'path':
-                    for row in range(len(sim_attrs)):
-                        new_sim_data['path'][row][0] *= self.sim_scale
-                        new_sim_data['path'][row][1] *= self.sim_scale
-                        
-                else:
-                    new_sim_data[sim_obj_name]['coordinates'][0] *= self.sim_scale
-                    new_sim_data[sim_obj_name]['coordinates'][1] *= self.sim_scale
-                    
-                    if sim_obj_name != 'self':
-                        new_sim_data[sim_obj_name]['radius'] *= self.sim_scale
-                
-            self.sim_data.append(new_sim_data)
-            
+        # columnar cache next to the log, scaled to the scene on access
+        self.sim_data = simlog.SimulationLog(self.sim_filepath, self.sim_scale)
+        self.set_tree_types(self.sim_data.type_table)
         return len(self.sim_data)
             
             
     def get_tree_fullname(self, tree_partial_name):
-        tree_fullname = None
-        found_candidates = [t for t in self.imported_trees_names if tree_partial_name in t]
-        if len(found_candidates) > 0: tree_fullname = found_candidates[0]
-        return tree_fullname
+        return self.registry.get_tree_template(tree_partial_name)
             
             
     def get_tree_fullname_from_type(self, tree_type='A'):
@@ -253,95 +581,610 @@ class IndianaDrones:
     
     
     def is_tree(self, object_name):
-        is_tree = False
-        for t in self.trees_origins.keys():
-            if t in object_name:
-                is_tree = True
-                break
-            
-        return is_tree
+        return self.registry.role(object_name) in (registry.ROLE_TREE, registry.ROLE_TREE_TEMPLATE)
     
     
     def delete_cloned_trees(self):
-        for o in mybpy.get_all_objects_names():
-            if (self.is_tree(o)) and (not mybpy.get_object(o).hide_render):
-                mybpy.delete_objects([o])
+        self.delete_registered(registry.ROLE_TREE)
+        self.set_placed_trees(simlog.make_obstacles([], [], np.zeros((0, 2)), []),
+            np.zeros(0, dtype=object))
+        
+        
+    def set_placed_trees(self, obstacles, tree_names):
+        """Obstacles the cloned trees stand for, sorted by ID, and the tree object of each"""
+        order = np.argsort(obstacles['id'], kind='stable')
+        self.placed_obstacles, self.placed_tree_names = obstacles[order], tree_names[order]
+        
+        
+    def set_tree_types(self, type_table):
+        """Type table of the obstacles to come; codes are resolved when first needed"""
+        self.type_table = type_table
+        self.tree_types = None
+        
+        
+    def get_tree_types(self):
+        """Tree index of every obstacle type code and the tree names, resolved once per type"""
+        if self.tree_types is None or len(self.tree_types[0]) < len(self.type_table):
+            tree_names = list(dict.fromkeys(self.tree_letter_to_name.values()))
+            tree_by_type = np.array([tree_names.index(self.tree_letter_to_name[str(t)])
+                for t in self.type_table], dtype=np.int64)
+            self.tree_types = (tree_by_type, tree_names)
+        return self.tree_types
+        
+        
+    def get_tree_clone_source(self, tree_name, level):
+        """Object cloned for a tree at a level of detail, the template when that level is missing"""
+        if (tree_name, level) not in self.tree_clone_sources:
+            tree_fullname = self.get_tree_lod_name(tree_name, level)
+            if not mybpy.is_object_in_scene(tree_fullname):
+                tree_fullname = self.get_tree_fullname(tree_name)
+            self.tree_clone_sources[(tree_name, level)] = tree_fullname
+        return self.tree_clone_sources[(tree_name, level)]
             
             
-    def set_trees_positions(self, sim_data):
+    @profiling.profiled
+    def set_trees_positions(self, take):
         
         self.delete_cloned_trees()
+        self.add_trees(self.cull_obstacles(take.obstacles))
         
-        # create and position new trees
-        for id, attrs in sim_data.items():
-            is_tree = (id != 'self') and (id != 'path')
-            if is_tree:
-                coords = attrs['coordinates']
-                tree_type = attrs['type']
-                tree_fullname = self.get_tree_fullname_from_type(tree_type)
-                cloned_tree = mybpy.clone_object(tree_fullname,
-                    self.coords_to_location(coords))
-                
+        
+    def get_visible_area(self):
+        """Floor footprints of the render cameras and the floor bounds, None when nothing can be culled"""
+        cameras = self.get_render_camera_objects()
+        if (not self.use_culling) or (not cameras): return None
+        half = self.floor_size / 2.
+        return [mybpy.get_camera_footprint(c.name) for c in cameras], ((-half, -half), (half, half))
+        
+        
+    @profiling.profiled
+    def cull_obstacles(self, obstacles):
+        """Obstacles that can land in frame, found through the incrementally updated grid"""
+        visible_area = self.get_visible_area()
+        if visible_area is None: return obstacles
+        footprints, bounds = visible_area
+        self.obstacle_index.update(obstacles['id'], np.column_stack((obstacles['x'], obstacles['y'])))
+        visible_ids = np.concatenate([self.obstacle_index.query_polygon(footprint, self.culling_margin,
+            bounds=bounds) for footprint in footprints])
+        return obstacles[np.isin(obstacles['id'], visible_ids)]
+        
+        
+    @profiling.profiled
+    def add_trees(self, obstacles):
+        """Clone a tree per obstacle, in one batch per tree and level of detail"""
+        if len(obstacles) == 0: return
+        tree_by_type, tree_names = self.get_tree_types()
+        trees = tree_by_type[obstacles['type']]
+        locations = np.column_stack((obstacles['x'], obstacles['y'], np.zeros(len(obstacles))))
+        
+        # create and position new trees, with the detail the cameras can show
+        levels = self.get_tree_lod_levels(locations, 2 * obstacles['radius'])
+        batches = trees * len(self.tree_lod_ratios) + levels
+        cloned_names = np.empty(len(obstacles), dtype=object)
+        for batch in np.unique(batches):
+            rows = np.flatnonzero(batches == batch)
+            tree_name = tree_names[trees[rows[0]]]
+            cloned_trees = mybpy.clone_objects(self.get_tree_clone_source(tree_name, int(levels[rows[0]])),
+                locations[rows].tolist(), linked=self.trees_linked)
+            cloned_names[rows] = cloned_trees
+            for cloned_tree in cloned_trees:
                 mybpy.set_attribute(cloned_tree, 'hide_viewport', False)
                 mybpy.set_attribute(cloned_tree, 'hide_render', False)
+                self.registry.register(cloned_tree, registry.ROLE_TREE, tree_type=tree_name)
+        
+        self.set_placed_trees(np.concatenate((self.placed_obstacles, obstacles)),
+            np.concatenate((self.placed_tree_names, cloned_names)))
+        
+        
+    @profiling.profiled
+    def update_trees_positions(self, take):
+        return self.update_trees(self.cull_obstacles(take.obstacles))
+        
+        
+    def update_trees(self, obstacles):
+        """Diff the trees in the scene against obstacles by ID:
+        move the ones that changed, add new IDs and remove vanished ones"""
+        if len(self.placed_obstacles) == 0 and self.registry.names(registry.ROLE_TREE):
+            self.delete_cloned_trees() # left by a saved scene, with no obstacles on record
+        placed, placed_names = self.placed_obstacles, self.placed_tree_names
+        tree_by_type = self.get_tree_types()[0]
+        
+        # same ID and same tree: kept, moved if needed; anything else is rebuilt
+        _, rows, placed_rows = np.intersect1d(obstacles['id'], placed['id'],
+            assume_unique=True, return_indices=True)
+        same_tree = tree_by_type[obstacles['type'][rows]] == tree_by_type[placed['type'][placed_rows]]
+        rows, placed_rows = rows[same_tree], placed_rows[same_tree]
+        
+        kept = np.zeros(len(placed), dtype=bool)
+        kept[placed_rows] = True
+        removed = placed_names[~kept].tolist()
+        mybpy.delete_objects([o for o in removed if mybpy.is_object_in_scene(o)])
+        for o in removed:
+            self.registry.unregister(o)
         
+        kept_obstacles = placed[placed_rows]
+        moved = np.hypot(obstacles['x'][rows] - kept_obstacles['x'],
+                         obstacles['y'][rows] - kept_obstacles['y']) > self.tree_move_tolerance
+        kept_obstacles[moved] = obstacles[rows[moved]]
+        for tree_name, x, y in zip(placed_names[placed_rows[moved]].tolist(),
+                obstacles['x'][rows[moved]].tolist(), obstacles['y'][rows[moved]].tolist()):
+            mybpy.set_attribute(tree_name, 'location', (x, y, 0))
+        self.set_placed_trees(kept_obstacles, placed_names[placed_rows])
         
+        added = np.ones(len(obstacles), dtype=bool)
+        added[rows] = False
+        self.add_trees(obstacles[added])
+        return int(added.sum()), len(removed)
+        
+        
+    @profiling.profiled
     def create_animation(self, take=0):
         
         # load scenario
         if self.sim_data is None: self.load_simulation() # just in case forgot
-        sim_data = self.sim_data[take]
-        self.create_path(coords2D=sim_data['path'])
-        robot_curr_coords = sim_data['self']['coordinates']
-        self.set_robot_position(robot_curr_coords, sim_data['self']['heading'])
-        self.set_trees_positions(sim_data)
+        record = self.sim_data.take(take)
+        if self.scene_update == 'incremental':
+            self.update_path(coords2D=record.path)
+        else:
+            self.create_path(coords2D=record.path)
+        self.set_robot_position(record.robot_coordinates, record.robot_heading)
+        if self.scene_update == 'incremental':
+            self.update_trees_positions(record)
+        else:
+            self.set_trees_positions(record)
         
         if take + 1 < len(self.sim_data):
             mybpy.setup_animation(frame_end=self.robot_frames_total, fps=self.sim_fps)
                 
             # create robot animation
-            robot_next_coords = self.sim_data[take + 1]['self']['coordinates']
+            robot_next_coords = self.sim_data.robot_coordinates(take + 1)
+            robot_step = robot_next_coords - record.robot_coordinates
+            robot_next_heading = math.atan2(robot_step[1], robot_step[0])
+            self.create_robot_rotation(record.robot_heading, robot_next_heading)
+            
+            self.create_robot_translation(record.robot_coordinates, robot_next_coords)
+            
+            
+    @profiling.profiled
+    def follow_simulation(self, source, *, window=10, output_folder=None, stop=None):
+        """Stream a running simulation into the scene, one record at a time.
+        Each record completes the robot motion of the take before it, which is
+        rendered to frames when output_folder is given, then replaces trees and
+        path in place. Only the last window takes keep their robot keys."""
+        parser = simlog.RecordParser(self.sim_scale)
+        self.set_tree_types(parser.type_table)
+        self.delete_cloned_trees() # obstacle codes start over with the stream
+        previous = None
+        for record in simlog.follow(source, parser=parser, stop=stop):
+            take = record.index
+            with profiling.PROFILER.take(take):
+                if previous is None:
+                    self.clear_robot_animation()
+                    self.set_robot_position(record.robot_coordinates, record.robot_heading)
+                else:
+                    self.set_robot_keys(take - 1, previous, record)
+                    self.set_live_window(take - 1, window)
+                    if output_folder: mybpy.render_frames(output_folder,
+                        *self.take_frame_range(take - 1), file_format='PNG')
+                self.update_path(record.path)
+                self.update_trees(self.cull_obstacles(record.obstacles))
+            previous = record
+        return parser.takes
+        
+        
+    def take_frame_range(self, take):
+        take_start = take * self.robot_frames_total
+        return take_start, take_start + self.robot_frames_total
+        
+        
+    def set_robot_keys(self, take, record, next_record):
+        """Append the robot's turn and move from a record to the next one"""
+        take_start, take_end = self.take_frame_range(take)
+        coords, next_coords = record.robot_coordinates, next_record.robot_coordinates
+        heading = record.robot_heading
+        next_heading = math.atan2(next_coords[1] - coords[1], next_coords[0] - coords[0]) \
+            if np.any(next_coords != coords) else heading
+        # held until the last frame of the take, like create_timeline_robot
+        mybpy.add_keyframes(self.robot_name, 'rotation_euler',
+            (take_start, take_start + self.robot_frames_rotation, take_end - 1),
+            ((0, math.pi/2, heading), (0, math.pi/2, next_heading), (0, math.pi/2, next_heading)),
+            replace=False)
+        mybpy.add_keyframes(self.robot_name, 'location',
+            (take_start + self.robot_frames_rotation, take_end),
+            (self.robot_coords_to_location(coords), self.robot_coords_to_location(next_coords)),
+            replace=False)
+        
+        
+    def set_live_window(self, take, window):
+        """Keep the frames of the last window takes, ending with take"""
+        frame_start = self.take_frame_range(max(0, take - window + 1))[0]
+        frame_end = self.take_frame_range(take)[1]
+        for data_path in ('rotation_euler', 'location'):
+            mybpy.remove_keyframes_before(self.robot_name, data_path, frame_start)
+        mybpy.setup_animation(frame_start=frame_start, frame_end=frame_end, fps=self.sim_fps)
+        bpy.context.scene.frame_current = frame_end
+        
+        
+    def plan_settings(self):
+        """What sceneplan needs to compute takes the way this scene builds them"""
+        return {
+            'sim_filepath': self.sim_filepath,
+            'sim_scale': self.sim_scale,
+            'path_mode': self.path_mode,
+            'scene_update': self.scene_update,
+            'path_wide': self.path_wide,
+            'path_thick': self.path_thick,
+            'path_tolerance': self.path_tolerance * self.path_wide,
+            'visible_area': self.get_visible_area(),
+            'culling_margin': self.culling_margin,
+        }
+        
+        
+    @profiling.profiled
+    def apply_plan(self, plan):
+        """Build a take from a plan computed ahead by sceneplan, like create_animation does"""
+        if self.path_mode != 'mesh':
+            self.create_path(plan.path)
+        elif self.scene_update == 'incremental':
+            if not self.has_lane():
+                self.create_lane_blocks(plan.path, plan.lane_blocks)
+            elif not self.is_lane_unchanged(plan.path):
+                self.patch_lane(plan.path, plan.lane_blocks)
+        else:
+            self.delete_path()
+            self.create_lane(plan.path, plan.lane_vertices, plan.lane_faces)
+        
+        self.set_robot_position(plan.robot_coordinates, plan.robot_heading)
+        
+        # obstacles were already culled by the plan
+        if self.scene_update == 'incremental':
+            self.update_trees(plan.obstacles)
+        else:
+            self.delete_cloned_trees()
+            self.add_trees(plan.obstacles)
+        
+        if plan.next_robot_coordinates is not None:
+            mybpy.setup_animation(frame_end=self.robot_frames_total, fps=self.sim_fps)
+            self.create_robot_rotation(plan.robot_heading, plan.next_robot_heading)
+            self.create_robot_translation(plan.robot_coordinates, plan.next_robot_coordinates)
+            
             
-            robot_next_heading = math.atan2(robot_next_coords[1] - robot_curr_coords[1],
-                                            robot_next_coords[0] - robot_curr_coords[0])
-            self.create_robot_rotation(sim_data['self']['heading'], robot_next_heading)
+    @profiling.profiled
+    def create_timeline(self, takes=None):
+        """Compile takes into one continuous animation, ready for a single render"""
+        if self.sim_data is None: self.load_simulation()
+        takes = list(range(len(self.sim_data))) if takes is None else list(takes)
+        take_starts = np.arange(len(takes)) * self.robot_frames_total
+        frame_end = len(takes) * self.robot_frames_total
+        
+        self.create_timeline_robot(takes, take_starts)
+        self.create_timeline_trees(takes, take_starts)
+        self.create_timeline_path(takes, take_starts)
+        
+        mybpy.setup_animation(frame_end=frame_end, fps=self.sim_fps)
+        return frame_end
+        
+        
+    def create_timeline_robot(self, takes, take_starts):
+        coords = np.array([self.sim_data.robot_coordinates(t) for t in takes]).reshape(-1, 2)
+        headings = np.array([self.sim_data.robot_heading(t) for t in takes])
+        
+        # every take turns towards the next position, then moves to it; the last one holds
+        next_coords = np.concatenate((coords[1:], coords[-1:]))
+        steps = next_coords - coords
+        next_headings = np.where(np.hypot(steps[:, 0], steps[:, 1]) > 0,
+            np.arctan2(steps[:, 1], steps[:, 0]), headings)
+        
+        # the turn is held until the last frame of the take, or the curve towards the
+        # next take's recorded heading would keep turning the robot while it moves
+        rotation_frames = np.stack((take_starts, take_starts + self.robot_frames_rotation,
+                                    take_starts + self.robot_frames_total - 1), axis=1)
+        rotations = np.zeros((len(takes), 3, 3))
+        rotations[:, :, 1] = math.pi / 2
+        rotations[:, 0, 2] = headings
+        rotations[:, 1:, 2] = next_headings[:, None]
+        mybpy.add_keyframes(self.robot_name, 'rotation_euler',
+            rotation_frames.ravel(), rotations.reshape(-1, 3))
+        
+        translation_frames = np.stack((take_starts + self.robot_frames_rotation,
+                                       take_starts + self.robot_frames_total), axis=1)
+        locations = np.full((len(takes), 2, 3), self.robot_high)
+        locations[:, 0, :2] = coords
+        locations[:, 1, :2] = next_coords
+        mybpy.add_keyframes(self.robot_name, 'location',
+            translation_frames.ravel(), locations.reshape(-1, 3))
+        
+        
+    def create_timeline_trees(self, takes, take_starts):
+        # one pooled tree per obstacle ID, shown only during the takes it is in
+        records = [self.sim_data.take(take) for take in takes]
+        obstacles = np.concatenate([r.obstacles for r in records])
+        frames = np.repeat(take_starts, [len(r.obstacles) for r in records])
+        
+        # keep obstacles seen by the cameras in any of their positions
+        visible_area = self.get_visible_area()
+        if visible_area is not None:
+            footprints, bounds = visible_area
+            in_view = geometry.points_in_view(np.column_stack((obstacles['x'], obstacles['y'])),
+                footprints, bounds, self.culling_margin)
+            seen = np.isin(obstacles['id'], obstacles['id'][in_view])
+            obstacles, frames = obstacles[seen], frames[seen]
             
-            self.create_robot_translation(robot_curr_coords, robot_next_coords)
+        # rows grouped by ID, in take order
+        order = np.argsort(obstacles['id'], kind='stable')
+        obstacles, frames = obstacles[order], frames[order]
+        _, first_rows, counts = np.unique(obstacles['id'], return_index=True, return_counts=True)
+        
+        self.delete_cloned_trees()
+        self.add_trees(obstacles[first_rows])
+        
+        # placed trees are sorted by ID too
+        for tree_name, first, count in zip(self.placed_tree_names.tolist(), first_rows.tolist(),
+                counts.tolist()):
+            rows = slice(first, first + count)
+            hidden = np.ones(len(take_starts), dtype=bool)
+            hidden[np.searchsorted(take_starts, frames[rows])] = False
+            changes = np.flatnonzero(np.concatenate(([True], hidden[1:] != hidden[:-1])))
+            for data_path in ('hide_viewport', 'hide_render'):
+                mybpy.add_keyframes(tree_name, data_path, take_starts[changes], hidden[changes],
+                    interpolation='CONSTANT')
+            locations = np.column_stack((obstacles['x'][rows], obstacles['y'][rows], np.zeros(count)))
+            mybpy.add_keyframes(tree_name, 'location', frames[rows], locations,
+                interpolation='CONSTANT')
+                
+                
+    def create_timeline_path(self, takes, take_starts):
+        # one curve lane for the whole run, its points keyed at every take start
+        self.delete_path()
+        paths = [geometry.remove_repeated_points(self.simplify_path(self.sim_data.take_path(take)))
+            for take in takes]
+        number_points = max([2] + [len(p) for p in paths])
+        points = np.stack([geometry.pad_polyline(p, number_points) for p in paths])
+        self.lane_name = mybpy.create_lane_curve(points[0], wide=self.path_wide,
+            thick=self.path_thick, color=self.path_color, object_name=self.path_name + '_Lane')
+        self.registry.register(self.lane_name, registry.ROLE_PATH)
+        
+        for p in range(number_points):
+            changes = np.concatenate(([True], np.any(points[1:, p] != points[:-1, p], axis=1)))
+            mybpy.add_keyframes(self.lane_name, 'data.splines[0].points[' + str(p) + '].co',
+                take_starts[changes], points[changes, p], interpolation='CONSTANT')
+        
+        # the lane grows along the route at each take start, and is hidden without a route
+        shown = np.array([len(p) >= 2 for p in paths], dtype=float)
+        reveal_frames = min(self.path_reveal_frames or 0, self.robot_frames_total - 2)
+        if reveal_frames > 0:
+            frames = np.stack((take_starts, take_starts + reveal_frames,
+                take_starts + self.robot_frames_total - 1), axis=1)
+            ends = np.stack((np.zeros(len(takes)), shown, shown), axis=1)
+            mybpy.add_keyframes(self.lane_name, 'data.bevel_factor_end', frames.ravel(),
+                ends.ravel(), interpolation='LINEAR')
+        else:
+            mybpy.add_keyframes(self.lane_name, 'data.bevel_factor_end', take_starts, shown,
+                interpolation='CONSTANT')
+        
+        
+    def scene_parameters(self):
+        """Settings from __init__ that change how a take looks"""
+        names = ('robot_high', 'robot_frames_rotation', 'robot_frames_translation',
+            'camera_location', 'camera_rotation_euler', 'camera_rigs',
+            'sun_energy', 'sun_location', 'sun_rotation_euler',
+            'diffuselight_energy', 'diffuselight_location', 'floor_size',
+            'path_wide', 'path_thick', 'path_color', 'path_mode', 'path_reveal_frames',
+            'path_tolerance',
+            'use_tree_lod', 'tree_lod_ratios', 'tree_lod_texture_sizes', 'tree_lod_pixel_thresholds',
+            'use_culling', 'culling_margin',
+            'tree_letter_to_name', 'trees_origins', 'sim_scale', 'sim_fps')
+        return {name: getattr(self, name) for name in names}
+        
+        
+    def asset_digests(self):
+        asset_filepaths = (self.robot_filepath, self.trees_filepath,
+            os.path.splitext(self.trees_filepath)[0] + '.mtl')
+        return {os.path.basename(f): rendercache.file_digest(f)
+            for f in asset_filepaths if os.path.exists(f)}
+        
+        
+    def render_cache_key(self, take):
+        """Digest of everything a take's render depends on"""
+        next_coords = self.sim_data.robot_coordinates(take + 1).tolist() \
+            if take + 1 < len(self.sim_data) else None
+        return rendercache.data_digest({
+            'take': self.sim_data.take(take).digest_data(self.sim_data.id_table,
+                self.sim_data.type_table),
+            'next_coordinates': next_coords,
+            'scene': self.scene_parameters(),
+            'assets': self.asset_digests(),
+            'render': mybpy.get_render_settings(),
+            'render_profile': self.render_profiles[self.get_take_render_profile(take)],
+        })
+        
+        
+    def render_run_key(self):
+        """Digest of everything the timeline render depends on"""
+        return rendercache.data_digest({
+            'sim': simlog.source_signature(self.sim_filepath),
+            'scene': self.scene_parameters(),
+            'assets': self.asset_digests(),
+            'render': mybpy.get_render_settings(),
+            'render_profile': self.render_profiles[self.get_take_render_profile()],
+        })
+        
+        
+    def get_take_render_profile(self, take=None):
+        return self.take_render_profiles.get(take, self.render_profile)
+        
+        
+    def apply_render_profile(self, profile_name=None):
+        """Apply a named render profile on top of the settings the .blend had"""
+        profile_name = profile_name or self.render_profile
+        if self.base_render_quality is None: self.base_render_quality = mybpy.get_render_quality()
+        profile = dict(self.render_profiles[profile_name])
+        use_diffuse_light = profile.pop('use_diffuse_light', True)
+        mybpy.set_render_quality(**dict(self.base_render_quality, **profile))
+        if mybpy.is_object_in_scene(self.diffuselight_name):
+            mybpy.set_attribute(self.diffuselight_name, 'hide_render', not use_diffuse_light)
+        return profile_name
+        
+        
+    @profiling.profiled
+    def render_take(self, take, output_folder=None):
+        """Render the animation built by create_animation, reusing a cached file if unchanged"""
+        profile_name = self.apply_render_profile(self.get_take_render_profile(take))
+        cache = None
+        if self.use_render_cache:
+            if self.render_cache is None:
+                self.render_cache = rendercache.RenderCache(self.render_cache_folder)
+            cache = self.render_cache
+        take_str = 'take_' + str(take).zfill(2)
+        if profile_name != 'final': take_str += '_' + profile_name
+        def render(suffix):
+            # the key covers the active camera, so every view is cached on its own
+            cache_key = self.render_cache_key(take) \
+                if cache is not None or self.render_resumable else None
+            return mybpy.render_animation(take_str + suffix, output_folder=output_folder,
+                cache=cache, cache_key=cache_key, resumable=self.render_resumable)
+        return self.render_with_cameras(render)
+        
+        
+    def render_run(self, filename='run', output_folder=None):
+        """Render the timeline built by create_timeline, once per render camera"""
+        self.apply_render_profile()
+        return self.render_with_cameras(lambda suffix: mybpy.render_animation(filename + suffix,
+            output_folder=output_folder, resumable=self.render_resumable,
+            cache_key=self.render_run_key() if self.render_resumable else None))
         
 
 def set_attribute(object_name, attribute, value):
     setattr(get_object(object_name), attribute, value)
+
+
+def pad_lane_blocks(blocks, capacity):
+    """Lane blocks followed by spare ones, collapsed at the origin where they draw nothing"""
+    padded = np.zeros((capacity,) + blocks.shape[1:])
+    padded[:len(blocks)] = blocks
+    return padded
       
 
-id = IndianaDrones()
+def parse_arguments(argv):
+    """Options given after '--' on the Blender command line"""
+    argv = argv[argv.index('--') + 1:] if '--' in argv else []
+    parser = argparse.ArgumentParser(prog='IndianaDrones')
+    parser.add_argument('--local-folder', help='folder of the assets, defaults to the script folder')
+    parser.add_argument('--cache-folder', help='folder of the asset and render caches, defaults to the local folder')
+    parser.add_argument('--sim', help='simulation log, defaults to coordinates.json in the local folder')
+    parser.add_argument('--takes', type=int, nargs='*', default=[0], help='takes to animate')
+    parser.add_argument('--all-takes', action='store_true')
+    parser.add_argument('--timeline', action='store_true',
+        help='one continuous animation for the whole run')
+    parser.add_argument('--frame-range', type=int, nargs=2, metavar=('START', 'END'),
+        help='timeline frames to render as an image sequence')
+    parser.add_argument('--render', action='store_true')
+    parser.add_argument('--output', help='folder for rendered files')
+    parser.add_argument('--no-cache', action='store_true', help='render takes even if unchanged')
+    parser.add_argument('--profile', metavar='REPORT',
+        help='record stage timings and write a JSON report (plus CSV files) there')
+    parser.add_argument('--resumable', action='store_true',
+        help='render frame by frame with a manifest, resuming from the first missing frame')
+    parser.add_argument('--render-profile', default='final',
+        help='render profile for the run: draft, preview, final or workbench')
+    parser.add_argument('--take-profile', nargs=2, action='append', default=[], metavar=('TAKE', 'PROFILE'),
+        help='render profile for one take, overriding --render-profile')
+    parser.add_argument('--pipeline', type=int, default=0, metavar='PROCESSES',
+        help='compute upcoming takes in this many processes while the current one renders')
+    parser.add_argument('--lookahead', type=int, default=4, help='takes computed ahead with --pipeline')
+    parser.add_argument('--follow', metavar='SOURCE',
+        help='stream a running simulation from a file, named pipe or tcp://host:port')
+    parser.add_argument('--window', type=int, default=10, help='takes kept animated with --follow')
+    parser.add_argument('--cameras', nargs='+', metavar='RIG',
+        help='camera rigs to render from the same scene build: top, angled, side')
+    parser.add_argument('--incremental', action='store_true',
+        help='update trees and path from the previous take instead of rebuilding them')
+    return parser.parse_args(argv)
+
+
+def main(argv):
+    args = parse_arguments(argv)
+    
+    if args.profile: profiling.PROFILER.enable(counters=mybpy.count_datablocks)
+    
+    id = IndianaDrones(args.local_folder, cache_folder=args.cache_folder)
+    if args.sim: id.sim_filepath = args.sim
+    if args.no_cache: id.use_render_cache = False
+    if args.resumable: id.render_resumable = True
+    if args.incremental: id.scene_update = 'incremental'
+    if args.cameras: id.render_cameras = args.cameras
+    id.render_profile = args.render_profile
+    id.take_render_profiles = {int(take): profile_name for take, profile_name in args.take_profile}
 
-id.load_objects()
-#id.load_objects(clear_objects=True)
-#print('Loaded objects in scene')
+    id.load_objects()
+    #id.load_objects(clear_objects=True)
+    #print('Loaded objects in scene')
 
-##mybpy.delete_all_objects()
-#id.create_camera()
-###id.create_light()
-###id.create_sun()
-##id.create_floor()
-##id.import_robot()
-##id.import_trees()
-####id.create_path()
+    ##mybpy.delete_all_objects()
+    #id.create_camera()
+    ###id.create_light()
+    ###id.create_sun()
+    ##id.create_floor()
+    ##id.import_robot()
+    ##id.import_trees()
+    ####id.create_path()
 
-number_takes = id.load_simulation()
+    if args.follow:
+        id.scene_update = 'incremental'
+        number_takes = id.follow_simulation(args.follow, window=args.window,
+            output_folder=args.output if args.render else None)
+        print('Followed', number_takes, 'takes')
+        if args.profile: print('Profile written to', profiling.PROFILER.write_report(args.profile))
+        return
 
-#bpy.context.scene.render.filepath = os.path.join('C:', 'tmp')
+    number_takes = id.load_simulation()
 
-for take in [0]:
-#for take in range(1, number_takes):
-    take_str = 'take_' + str(take).zfill(2)
-    print('Rendering', take_str)
+    #bpy.context.scene.render.filepath = os.path.join('C:', 'tmp')
     
-    id.create_animation(take)
+    takes = range(number_takes) if args.all_takes else args.takes
+
+    if args.timeline:
+        print('Rendering whole run,', number_takes, 'takes')
+        id.create_timeline()
+        if args.render:
+            id.apply_render_profile()
+            if args.frame_range:
+                mybpy.render_frames_resumable(args.output or bpy.context.scene.render.filepath,
+                    *args.frame_range, content_key=id.render_run_key())
+            else:
+                id.render_run('run', output_folder=args.output)
+
+    elif args.pipeline > 0:
+        plans = sceneplan.plan_takes(id.plan_settings(), takes,
+            processes=args.pipeline, lookahead=args.lookahead)
+        for plan in plans:
+            print('Rendering', 'take_' + str(plan.take).zfill(2))
+            
+            with profiling.PROFILER.take(plan.take):
+                id.apply_render_profile(id.get_take_render_profile(plan.take))
+                id.apply_plan(plan)
+                
+                if args.render: id.render_take(plan.take, output_folder=args.output)
+
+    else:
+        for take in takes:
+            take_str = 'take_' + str(take).zfill(2)
+            print('Rendering', take_str)
+            
+            with profiling.PROFILER.take(take):
+                # before building, so tree detail follows the profile's resolution
+                id.apply_render_profile(id.get_take_render_profile(take))
+                id.create_animation(take)
 
-#    mybpy.render_animation(take_str)
+                if args.render: id.render_take(take, output_folder=args.output)
 
 
-print('Render finished')
-## measure, calculate_path, rotate, move
-#mybpy.delete_all_objects()
+    print('Render finished')
+    print('Datablocks:', mybpy.count_datablocks())
+    if args.profile: print('Profile written to', profiling.PROFILER.write_report(args.profile))
+    ## measure, calculate_path, rotate, move
+    #mybpy.delete_all_objects()
+    
+    
+if __name__ == '__main__':
+    main(sys.argv)
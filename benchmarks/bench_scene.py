@@ -0,0 +1,129 @@
+"""Scene build scaling benchmark, run in background Blender:
+
+    blender -b -P benchmarks/bench_scene.py -- --sizes small medium large --label my-change
+
+Each size generates a synthetic log and times load_simulation, create_path,
+set_trees_positions and create_animation. Results go to
+benchmarks/results/<label>.json; compare two of them with compare.py.
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+benchmarks_folder = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(benchmarks_folder)
+sys.path.append(os.path.dirname(benchmarks_folder))
+
+import bpy
+
+import IndianaDrones as indiana
+import generate_sim
+import mybpy
+import registry
+
+
+SIZES = {
+    # takes, obstacles, path points
+    'small': (10, 20, 30),
+    'medium': (100, 200, 1000),
+    'large': (100, 1000, 10000),
+}
+
+
+def git_revision(folder):
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=folder,
+            stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def create_placeholder_trees(id):
+    """Low-poly hidden templates for each tree type, for trees OBJ files not at hand"""
+    for t, tree_name in enumerate(id.trees_origins.keys()):
+        template_name = mybpy.create_cylinder(radius=1, depth=4, object_name='Placeholder_' + tree_name,
+            location=(0, 0, -100 - 10 * t))
+        mybpy.set_attribute(template_name, 'hide_viewport', True)
+        mybpy.set_attribute(template_name, 'hide_render', True)
+        id.registry.register(template_name, registry.ROLE_TREE_TEMPLATE, tree_type=tree_name)
+
+
+def timed(function, *args, repeats=3, setup=None):
+    """Median wall time in seconds of a call over a few repeats"""
+    durations = []
+    for _ in range(repeats):
+        if setup is not None: setup()
+        started = time.perf_counter()
+        function(*args)
+        durations.append(time.perf_counter() - started)
+    return statistics.median(durations)
+
+
+def run_size(id, name, takes, obstacles, path_points, work_folder, *, repeats=3):
+    id.sim_filepath = generate_sim.write_log(os.path.join(work_folder, name + '.json'),
+        takes, obstacles, path_points)
+    
+    # the first load converts the log, the following ones only map the cache
+    started = time.perf_counter()
+    id.load_simulation()
+    results = {'load_simulation_cold': time.perf_counter() - started}
+    results['load_simulation'] = timed(id.load_simulation, repeats=repeats)
+    
+    take = id.sim_data.take(0)
+    results['create_path'] = timed(id.create_path, take.path, repeats=repeats)
+    results['set_trees_positions'] = timed(id.set_trees_positions, take, repeats=repeats)
+    results['create_animation'] = timed(id.create_animation, 0, repeats=repeats,
+        setup=id.reset_dynamic_objects)
+    results['objects'] = len(bpy.data.objects)
+    id.reset_dynamic_objects()
+    return results
+
+
+def parse_arguments(argv):
+    argv = argv[argv.index('--') + 1:] if '--' in argv else []
+    parser = argparse.ArgumentParser(prog='bench_scene')
+    parser.add_argument('--sizes', nargs='*', default=list(SIZES), choices=list(SIZES))
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--label', help='result name, defaults to the git revision')
+    parser.add_argument('--output-folder', default=os.path.join(benchmarks_folder, 'results'))
+    parser.add_argument('--placeholder-trees', action='store_true',
+        help='use simple templates instead of importing Trees/trees9.obj')
+    return parser.parse_args(argv)
+
+
+def main(argv):
+    args = parse_arguments(argv)
+    repository_folder = os.path.dirname(benchmarks_folder)
+    
+    id = indiana.IndianaDrones(local_folder=repository_folder)
+    id.use_render_cache = False
+    if args.placeholder_trees or not os.path.exists(id.trees_filepath):
+        id.use_tree_lod = False
+        create_placeholder_trees(id)
+    id.load_objects()
+    
+    revision = git_revision(repository_folder)
+    report = {'revision': revision, 'blender': bpy.app.version_string,
+              'python': platform.python_version(), 'machine': platform.machine(), 'sizes': {}}
+    with tempfile.TemporaryDirectory() as work_folder:
+        for name in args.sizes:
+            takes, obstacles, path_points = SIZES[name]
+            print('Benchmarking', name, SIZES[name])
+            report['sizes'][name] = dict(takes=takes, obstacles=obstacles, path_points=path_points,
+                **run_size(id, name, takes, obstacles, path_points, work_folder, repeats=args.repeats))
+            
+    os.makedirs(args.output_folder, exist_ok=True)
+    result_filepath = os.path.join(args.output_folder, (args.label or revision or 'results') + '.json')
+    with open(result_filepath, 'w') as f:
+        json.dump(report, f, indent=1)
+    print('Results written to', result_filepath)
+    
+    
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,44 @@
+"""Compare two bench_scene result files:
+
+    python benchmarks/compare.py benchmarks/results/baseline.json benchmarks/results/my-change.json
+
+Exits with status 1 when a stage got slower than the tolerance allows.
+"""
+import argparse
+import json
+import sys
+
+
+STAGES = ('load_simulation_cold', 'load_simulation', 'create_path', 'set_trees_positions',
+          'create_animation')
+
+
+def compare(baseline, candidate, *, tolerance=.1):
+    """Rows of (size, stage, baseline seconds, candidate seconds, ratio, is regression)"""
+    rows = []
+    for size, baseline_results in baseline['sizes'].items():
+        candidate_results = candidate['sizes'].get(size)
+        if candidate_results is None: continue
+        for stage in STAGES:
+            if stage not in baseline_results or stage not in candidate_results: continue
+            before, after = baseline_results[stage], candidate_results[stage]
+            ratio = after / before if before > 0 else float('inf')
+            rows.append((size, stage, before, after, ratio, ratio > 1 + tolerance))
+    return rows
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(prog='compare')
+    parser.add_argument('baseline')
+    parser.add_argument('candidate')
+    parser.add_argument('--tolerance', type=float, default=.1, help='allowed slowdown, 0.1 is 10%%')
+    args = parser.parse_args()
+    with open(args.baseline) as f: baseline = json.load(f)
+    with open(args.candidate) as f: candidate = json.load(f)
+
+    rows = compare(baseline, candidate, tolerance=args.tolerance)
+    print('{:8} {:22} {:>10} {:>10} {:>7}'.format('size', 'stage', 'baseline', 'candidate', 'ratio'))
+    for size, stage, before, after, ratio, is_regression in rows:
+        print('{:8} {:22} {:10.4f} {:10.4f} {:7.2f}{}'.format(size, stage, before, after, ratio,
+            '  REGRESSION' if is_regression else ''))
+    sys.exit(1 if any(row[-1] for row in rows) else 0)
@@ -0,0 +1,65 @@
+"""Synthetic simulation logs in the coordinates.json schema, of any size.
+
+    python benchmarks/generate_sim.py out.json --takes 100 --obstacles 1000 --path-points 10000
+"""
+import argparse
+import json
+import math
+import random
+
+
+OBSTACLE_TYPES = 'ACDEFGHJKLMNOPQRSTUV'
+
+
+def generate_records(takes=10, obstacles=20, path_points=30, *, world_size=20., seed=0):
+    """Yield one record per take: the robot walks along a wiggly path towards a goal
+    while a persistent set of obstacles jitters around, like the recorded logs"""
+    rng = random.Random(seed)
+    obstacle_ids = [str(rng.getrandbits(128)) for _ in range(obstacles)]
+    obstacle_attrs = {id: {'coordinates': [rng.uniform(-world_size / 2, world_size / 2),
+                                           rng.uniform(-world_size / 2, world_size / 2)],
+                           'type': rng.choice(OBSTACLE_TYPES),
+                           'radius': round(rng.uniform(.1, .6), 1)}
+                      for id in obstacle_ids}
+
+    step = world_size / max(path_points, 1)
+    route = [[0., 0.]]
+    heading = 0.
+    for _ in range(path_points - 1):
+        heading += rng.uniform(-.4, .4)
+        route.append([route[-1][0] + step * math.cos(heading), route[-1][1] + step * math.sin(heading)])
+
+    for take in range(takes):
+        # the remaining path starts where the robot is, so it shrinks take after take
+        position = min(take * max(len(route) // max(takes, 1), 1), len(route) - 2)
+        robot = route[position]
+        ahead = route[position + 1]
+        record = {'self': {'coordinates': [round(c, 3) for c in robot],
+                           'heading': math.atan2(ahead[1] - robot[1], ahead[0] - robot[0])}}
+        for id in obstacle_ids:
+            x, y = obstacle_attrs[id]['coordinates']
+            record[id] = {'coordinates': [round(x + rng.gauss(0, .02), 3), round(y + rng.gauss(0, .02), 3)],
+                          'type': obstacle_attrs[id]['type'],
+                          'radius': obstacle_attrs[id]['radius']}
+        record['path'] = [[round(x, 3), round(y, 3)] for x, y in route[position:]]
+        yield record
+
+
+def write_log(filepath, takes=10, obstacles=20, path_points=30, *, world_size=20., seed=0):
+    with open(filepath, 'w') as f:
+        for record in generate_records(takes, obstacles, path_points, world_size=world_size, seed=seed):
+            f.write(json.dumps(record) + '\n')
+    return filepath
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(prog='generate_sim')
+    parser.add_argument('filepath')
+    parser.add_argument('--takes', type=int, default=10)
+    parser.add_argument('--obstacles', type=int, default=20)
+    parser.add_argument('--path-points', type=int, default=30)
+    parser.add_argument('--world-size', type=float, default=20.)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    write_log(args.filepath, args.takes, args.obstacles, args.path_points,
+        world_size=args.world_size, seed=args.seed)
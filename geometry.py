@@ -0,0 +1,372 @@
+import numpy as np
+
+
+def segment_directions(points):
+    """Unit direction, left normal and length of every polyline segment"""
+    deltas = points[1:] - points[:-1]
+    lengths = np.hypot(deltas[:, 0], deltas[:, 1])
+    directions = deltas / lengths[:, None]
+    normals = np.stack((-directions[:, 1], directions[:, 0]), axis=1)
+    return directions, normals, lengths
+
+
+def remove_repeated_points(points, eps=1e-9):
+    """Drop consecutive duplicates, which have no direction to offset from"""
+    points = np.asarray(points, dtype=float).reshape(-1, 2)
+    if len(points) < 2: return points
+    keep = np.ones(len(points), dtype=bool)
+    keep[1:] = np.hypot(*(points[1:] - points[:-1]).T) > eps
+    return points[keep]
+
+
+def lane_outline(coords2D, wide=1., *, join_resolution=8):
+    """Flat stroke of a polyline: one quad per segment plus a round wedge
+    on the outer side of every join.
+    Returns (vertices (N,2), triangles (M,3), boundary edges (E,2))."""
+    points = remove_repeated_points(coords2D)
+    if len(points) < 2:
+        return np.zeros((0, 2)), np.zeros((0, 3), dtype=np.int32), np.zeros((0, 2), dtype=np.int32)
+
+    radius = float(wide) / 2
+    directions, normals, _ = segment_directions(points)
+    n_segments = len(directions)
+
+    # segment quads: left/right corners at both ends of every segment
+    offsets = radius * normals
+    quads = np.stack((points[:-1] + offsets, points[:-1] - offsets,
+                      points[1:] + offsets, points[1:] - offsets), axis=1)
+    quad_vertices = quads.reshape(-1, 2)
+    base = 4 * np.arange(n_segments, dtype=np.int32)[:, None]
+    quad_triangles = (base[:, None] + np.array([[1, 3, 2], [1, 2, 0]], dtype=np.int32)).reshape(-1, 3)
+    quad_edges = (base[:, None] + np.array([[2, 0], [1, 3]], dtype=np.int32)).reshape(-1, 2)
+    cap_edges = np.array([[0, 1], [4 * n_segments - 1, 4 * n_segments - 2]], dtype=np.int32)
+
+    # round joins: fan around the shared point covering the gap on the outer side
+    cross = directions[:-1, 0] * directions[1:, 1] - directions[:-1, 1] * directions[1:, 0]
+    side = np.where(cross >= 0, -1., 1.)[:, None]
+    outer_from = side * normals[:-1]
+    outer_to = side * normals[1:]
+    angle_from = np.arctan2(outer_from[:, 1], outer_from[:, 0])
+    sweep = np.arctan2(outer_to[:, 1], outer_to[:, 0]) - angle_from
+    sweep = (sweep + np.pi) % (2 * np.pi) - np.pi
+    is_turn = np.abs(sweep) > 1e-6
+
+    centers = points[1:-1][is_turn]
+    angle_from, sweep = angle_from[is_turn], sweep[is_turn]
+    n_joins = len(centers)
+    steps = np.linspace(0., 1., join_resolution + 1)
+    angles = angle_from[:, None] + sweep[:, None] * steps[None, :]
+    arcs = centers[:, None, :] + radius * np.stack((np.cos(angles), np.sin(angles)), axis=2)
+    fans = np.concatenate((centers[:, None, :], arcs), axis=1)
+    fan_vertices = fans.reshape(-1, 2)
+
+    fan_size = join_resolution + 2
+    fan_base = len(quad_vertices) + fan_size * np.arange(n_joins, dtype=np.int32)[:, None]
+    k = np.arange(1, join_resolution + 1, dtype=np.int32)
+    counter_clockwise = (sweep > 0)[:, None]
+    first = np.where(counter_clockwise, k, k + 1)
+    second = np.where(counter_clockwise, k + 1, k)
+    fan_triangles = np.stack((np.broadcast_to(fan_base, first.shape),
+                              fan_base + first, fan_base + second), axis=2).reshape(-1, 3)
+    fan_edges = np.stack((fan_base + first, fan_base + second), axis=2).reshape(-1, 2)
+
+    vertices = np.concatenate((quad_vertices, fan_vertices))
+    triangles = np.concatenate((quad_triangles, fan_triangles))
+    edges = np.concatenate((quad_edges, cap_edges, fan_edges))
+    return vertices, triangles, edges
+
+
+def extrude_outline(vertices2D, triangles, edges, thick=.1, *, z=0.):
+    """Turn a flat outline into a slab of height `thick` centered at z.
+    Returns (vertices (2N,3), triangles (K,3))."""
+    n_vertices = len(vertices2D)
+    top = np.column_stack((vertices2D, np.full(n_vertices, z + thick / 2.)))
+    bottom = np.column_stack((vertices2D, np.full(n_vertices, z - thick / 2.)))
+    a, b = edges[:, 0], edges[:, 1]
+    walls = np.concatenate((np.stack((a, a + n_vertices, b + n_vertices), axis=1),
+                            np.stack((a, b + n_vertices, b), axis=1)))
+    vertices = np.concatenate((top, bottom))
+    faces = np.concatenate((triangles, triangles[:, ::-1] + n_vertices, walls))
+    return vertices, faces.astype(np.int32)
+
+
+def lane_mesh(coords2D, wide=1., thick=.1, *, join_resolution=8):
+    """Vertices and triangles of the whole lane, ready for a single mesh"""
+    vertices2D, triangles, edges = lane_outline(coords2D, wide, join_resolution=join_resolution)
+    return extrude_outline(vertices2D, triangles, edges, thick)
+
+
+def lane_block_size(join_resolution=8):
+    """Vertices of a lane block: quad, join fan and two caps, on top then at the bottom"""
+    return 2 * (join_resolution + 10)
+
+
+def lane_blocks(coords2D, wide=1., thick=.1, *, join_resolution=8, z=0.):
+    """The lane as one fixed-size block of vertices per segment, the last segment first.
+    A block holds the segment quad, the round join at its end and copies of the start
+    and end corners for the caps; parts a segment does not need collapse to a point.
+    Paths sharing a tail so share their first blocks, and every block has the same
+    faces (lane_block_faces), so an update only needs to write the blocks that differ.
+    Returns vertices (segments, lane_block_size, 3)."""
+    points = remove_repeated_points(coords2D)
+    n_segments = max(len(points) - 1, 0)
+    if n_segments == 0: return np.zeros((0, lane_block_size(join_resolution), 3))
+
+    radius = float(wide) / 2
+    directions, normals, _ = segment_directions(points)
+    offsets = radius * normals
+    quads = np.stack((points[:-1] + offsets, points[:-1] - offsets,
+                      points[1:] + offsets, points[1:] - offsets), axis=1)
+
+    # join fans at the end of every segment but the last, collapsed where there is no turn
+    fans = np.repeat(points[1:, None, :], join_resolution + 2, axis=1)
+    if n_segments > 1:
+        cross = directions[:-1, 0] * directions[1:, 1] - directions[:-1, 1] * directions[1:, 0]
+        side = np.where(cross >= 0, -1., 1.)[:, None]
+        outer_from, outer_to = side * normals[:-1], side * normals[1:]
+        angle_from = np.arctan2(outer_from[:, 1], outer_from[:, 0])
+        sweep = np.arctan2(outer_to[:, 1], outer_to[:, 0]) - angle_from
+        sweep = (sweep + np.pi) % (2 * np.pi) - np.pi
+        # arcs always run counter-clockwise, so every fan has the same faces
+        angles = np.where(sweep > 0, angle_from, angle_from + sweep)[:, None] \
+            + np.abs(sweep)[:, None] * np.linspace(0., 1., join_resolution + 1)[None, :]
+        arcs = points[1:-1, None, :] + radius * np.stack((np.cos(angles), np.sin(angles)), axis=2)
+        turns = np.flatnonzero(np.abs(sweep) > 1e-6)
+        fans[turns, 1:] = arcs[turns]
+
+    # cap corners, used by the first and the last segment only
+    start_caps = np.repeat(points[:-1, None, :], 2, axis=1)
+    start_caps[0] = quads[0, :2]
+    end_caps = np.repeat(points[1:, None, :], 2, axis=1)
+    end_caps[-1] = quads[-1, 2:]
+
+    outline = np.concatenate((quads, fans, start_caps, end_caps), axis=1)
+    heights = np.full(outline.shape[:2] + (1,), z + thick / 2.)
+    blocks = np.concatenate((np.concatenate((outline, heights), axis=2),
+                             np.concatenate((outline, heights - thick), axis=2)), axis=1)
+    return blocks[::-1]
+
+
+def lane_block_faces(n_blocks, join_resolution=8):
+    """Triangles of n_blocks consecutive lane blocks, see lane_blocks"""
+    k = np.arange(join_resolution, dtype=np.int32)[:, None]
+    fan_start, start_cap, end_cap = 5, join_resolution + 6, join_resolution + 8
+    triangles = np.concatenate(([[1, 3, 2], [1, 2, 0]],
+        np.hstack((np.full_like(k, 4), fan_start + k, fan_start + k + 1))))
+    edges = np.concatenate(([[2, 0], [1, 3]], np.hstack((fan_start + k, fan_start + k + 1)),
+        [[start_cap, start_cap + 1], [end_cap + 1, end_cap]]))
+    _, faces = extrude_outline(np.zeros((join_resolution + 10, 2)), triangles, edges)
+    offsets = lane_block_size(join_resolution) * np.arange(n_blocks, dtype=np.int32)
+    return (faces[None] + offsets[:, None, None]).reshape(-1, 3)
+
+
+def cylinder_mesh(radius=1., depth=1., vertices=32):
+    """Closed cylinder along z centered at the origin, like primitive_cylinder_add.
+    Returns (vertices (2V,3), faces) with quad sides and two n-gon caps."""
+    angles = 2 * np.pi * np.arange(vertices) / vertices
+    ring = radius * np.column_stack((np.cos(angles), np.sin(angles)))
+    top = np.column_stack((ring, np.full(vertices, depth / 2.)))
+    bottom = np.column_stack((ring, np.full(vertices, -depth / 2.)))
+    i = np.arange(vertices)
+    j = (i + 1) % vertices
+    sides = np.stack((i, i + vertices, j + vertices, j), axis=1)
+    faces = list(sides) + [np.arange(vertices), np.arange(2 * vertices - 1, vertices - 1, -1)]
+    return np.concatenate((top, bottom)), faces
+
+
+def box_mesh(dimensions=(1., 1., 1.)):
+    """Axis aligned box centered at the origin, like primitive_cube_add"""
+    half = np.asarray(dimensions, dtype=float) / 2.
+    corners = np.array([[x, y, z] for x in (-1, 1) for y in (-1, 1) for z in (-1, 1)], dtype=float)
+    faces = np.array([[0, 1, 3, 2], [4, 6, 7, 5], [0, 4, 5, 1],
+                      [2, 3, 7, 6], [0, 2, 6, 4], [1, 5, 7, 3]], dtype=np.int32)
+    return corners * half, faces
+
+
+def plane_mesh(size=1.):
+    """Square on the xy plane centered at the origin, like primitive_plane_add"""
+    half = size / 2.
+    vertices = np.array([[-half, -half, 0], [half, -half, 0], [half, half, 0], [-half, half, 0]])
+    return vertices, np.array([[0, 1, 2, 3]], dtype=np.int32)
+
+
+def projected_size(sizes, distances, *, lens=50., sensor_width=36., resolution_x=1920,
+        ortho_scale=None):
+    """Approximate on-screen width in pixels of objects of the given sizes.
+    Uses the orthographic scale when given, otherwise a pinhole perspective camera."""
+    sizes = np.asarray(sizes, dtype=float)
+    if ortho_scale is not None:
+        return sizes / ortho_scale * resolution_x
+    distances = np.maximum(np.asarray(distances, dtype=float), 1e-6)
+    return sizes * lens / (distances * sensor_width) * resolution_x
+
+
+def select_lod(pixels, pixel_thresholds):
+    """Level of detail per object: 0 above the first threshold, 1 above the second, ...
+    pixel_thresholds must be decreasing."""
+    pixels = np.asarray(pixels, dtype=float).reshape(-1, 1)
+    return np.sum(pixels < np.asarray(pixel_thresholds, dtype=float).reshape(1, -1), axis=1)
+
+
+def point_segment_distances(points, start, end):
+    """Distance from every point to the segment start-end"""
+    segment = end - start
+    length2 = float(np.dot(segment, segment))
+    if length2 == 0.:
+        return np.hypot(*(points - start).T)
+    t = np.clip((points - start) @ segment / length2, 0., 1.)
+    return np.hypot(*(points - (start + t[:, None] * segment)).T)
+
+
+def simplify_path(coords2D, tolerance):
+    """Ramer-Douglas-Peucker: keep the fewest points such that every dropped point
+    lies within tolerance of the simplified polyline"""
+    points = remove_repeated_points(coords2D)
+    if (tolerance <= 0) or (len(points) < 3): return points
+    keep = np.zeros(len(points), dtype=bool)
+    keep[[0, -1]] = True
+    ranges = [(0, len(points) - 1)]
+    while ranges:
+        first, last = ranges.pop()
+        if last - first < 2: continue
+        distances = point_segment_distances(points[first + 1:last], points[first], points[last])
+        farthest = int(np.argmax(distances))
+        if distances[farthest] > tolerance:
+            middle = first + 1 + farthest
+            keep[middle] = True
+            ranges += [(first, middle), (middle, last)]
+    return points[keep]
+
+
+def pad_polyline(coords2D, count):
+    """Same polyline with count points, the extra ones spread along its last segment,
+    so paths of different lengths can key the points of one spline"""
+    points = remove_repeated_points(coords2D)
+    extra = count - len(points)
+    if extra <= 0: return points[:count]
+    if len(points) < 2:
+        point = points[0] if len(points) else np.zeros(2)
+        return np.repeat(point[None], count, axis=0)
+    t = np.arange(1, extra + 1)[:, None] / (extra + 1.)
+    inserted = points[-2] + t * (points[-1] - points[-2])
+    return np.concatenate((points[:-1], inserted, points[-1:]))
+
+
+def floor_footprint(origins, directions, *, z=0., far=1e4):
+    """Where rays through the camera frame corners meet the plane at height z.
+    Rays that never reach the plane are cut at distance far, horizontally."""
+    origins = np.broadcast_to(np.asarray(origins, dtype=float), np.shape(directions))
+    directions = np.asarray(directions, dtype=float)
+    heights = origins[:, 2] - z
+    descending = directions[:, 2] < -1e-9
+    t = np.where(descending, -heights / np.where(descending, directions[:, 2], -1.), 0.)
+    points = origins[:, :2] + t[:, None] * directions[:, :2]
+    horizontal = directions[:, :2] / np.maximum(np.hypot(*directions[:, :2].T), 1e-12)[:, None]
+    far_points = origins[:, :2] + far * horizontal
+    return np.where((descending & (t <= far))[:, None], points, far_points)
+
+
+def points_in_convex_polygon(points, polygon, margin=0.):
+    """Points inside a convex polygon grown by margin, for either winding"""
+    points = np.asarray(points, dtype=float).reshape(-1, 2)
+    polygon = np.asarray(polygon, dtype=float)
+    edges = np.roll(polygon, -1, axis=0) - polygon
+    area2 = np.sum(polygon[:, 0] * np.roll(polygon[:, 1], -1) - np.roll(polygon[:, 0], -1) * polygon[:, 1])
+    lengths = np.maximum(np.hypot(*edges.T), 1e-12)
+    # signed distance to every edge line, positive on the inner side
+    cross = edges[:, 0] * (points[:, None, 1] - polygon[:, 1]) \
+        - edges[:, 1] * (points[:, None, 0] - polygon[:, 0])
+    distances = np.sign(area2 or 1.) * cross / lengths
+    return np.all(distances >= -margin, axis=1)
+
+
+def points_near_polygon(points, polygon, margin=0.):
+    """Points inside a convex polygon grown by margin and inside its bounding box grown
+    by margin, which trims the long mitered tips of acute corners.
+    The one culling rule, shared by points_in_view and GridIndex.query_polygon."""
+    points = np.asarray(points, dtype=float).reshape(-1, 2)
+    polygon = np.asarray(polygon, dtype=float)
+    lower, upper = polygon.min(axis=0) - margin, polygon.max(axis=0) + margin
+    return points_in_convex_polygon(points, polygon, margin) \
+        & np.all((points >= lower) & (points <= upper), axis=1)
+
+
+def points_in_view(points, footprints, bounds, margin=0.):
+    """Points within margin of any of the footprints and of the (lower, upper) bounds"""
+    points = np.asarray(points, dtype=float).reshape(-1, 2)
+    lower, upper = np.asarray(bounds[0]) - margin, np.asarray(bounds[1]) + margin
+    inside = np.zeros(len(points), dtype=bool)
+    for footprint in footprints:
+        inside |= points_near_polygon(points, footprint, margin)
+    return inside & np.all((points >= lower) & (points <= upper), axis=1)
+
+
+class GridIndex:
+    """Uniform grid over 2D points keyed by integer IDs.
+    An update only touches the cells of points that appeared, vanished or changed cell."""
+
+    def __init__(self, cell_size=10.):
+        self.cell_size = float(cell_size)
+        self.cells = {}
+        self.ids = np.zeros(0, dtype=np.int64) # sorted
+        self.points = np.zeros((0, 2))
+        self.point_cells = np.zeros((0, 2), dtype=np.int64)
+
+
+    def cells_of(self, points):
+        return np.floor(np.asarray(points, dtype=float) / self.cell_size).astype(np.int64)
+
+
+    def positions_of(self, ids):
+        """Rows of ids in the index and whether each one is there"""
+        if len(self.ids) == 0:
+            return np.zeros(len(ids), dtype=np.int64), np.zeros(len(ids), dtype=bool)
+        rows = np.minimum(np.searchsorted(self.ids, ids), len(self.ids) - 1)
+        return rows, self.ids[rows] == ids
+
+
+    def update(self, ids, points):
+        """Make the index hold exactly these points"""
+        ids = np.asarray(ids, dtype=np.int64)
+        order = np.argsort(ids, kind='stable')
+        ids, points = ids[order], np.asarray(points, dtype=float).reshape(-1, 2)[order]
+        cells = self.cells_of(points)
+        rows, known = self.positions_of(ids)
+        unchanged = known.copy()
+        if len(self.ids): unchanged &= np.all(self.point_cells[rows] == cells, axis=1)
+        kept = np.zeros(len(self.ids), dtype=bool)
+        kept[rows[unchanged]] = True
+
+        for id, cell in zip(self.ids[~kept].tolist(), self.point_cells[~kept].tolist()):
+            cell_ids = self.cells[tuple(cell)]
+            cell_ids.discard(id)
+            if not cell_ids: del self.cells[tuple(cell)]
+        for id, cell in zip(ids[~unchanged].tolist(), cells[~unchanged].tolist()):
+            self.cells.setdefault(tuple(cell), set()).add(id)
+        self.ids, self.points, self.point_cells = ids, points, cells
+
+
+    def query_box(self, lower, upper):
+        (i0, j0), (i1, j1) = self.cells_of(lower), self.cells_of(upper)
+        if (i1 - i0 + 1) * (j1 - j0 + 1) > len(self.cells):
+            cells = [c for c in self.cells if i0 <= c[0] <= i1 and j0 <= c[1] <= j1]
+        else:
+            cells = [(i, j) for i in range(i0, i1 + 1) for j in range(j0, j1 + 1)]
+        return np.fromiter((id for c in cells for id in self.cells.get(c, ())), dtype=np.int64)
+
+
+    def query_polygon(self, polygon, margin=0., *, bounds=None):
+        """IDs inside a convex polygon grown by margin, optionally also inside a (lower, upper) box"""
+        polygon = np.asarray(polygon, dtype=float)
+        lower, upper = polygon.min(axis=0) - margin, polygon.max(axis=0) + margin
+        if bounds is not None:
+            lower = np.maximum(lower, np.asarray(bounds[0]) - margin)
+            upper = np.minimum(upper, np.asarray(bounds[1]) + margin)
+            if np.any(lower > upper): return np.zeros(0, dtype=np.int64)
+        candidates = self.query_box(lower, upper)
+        if len(candidates) == 0: return candidates
+        points = self.points[self.positions_of(candidates)[0]]
+        inside = points_near_polygon(points, polygon, margin)
+        if bounds is not None:
+            inside &= np.all((points >= lower) & (points <= upper), axis=1)
+        return candidates[inside]
@@ -1,6 +1,12 @@
 import bpy
+import json
 import math
 import os
+import numpy as np
+
+import geometry
+import video
+from profiling import profiled
 
 
 def degree2radians(degree):
@@ -27,9 +33,49 @@ def get_all_objects_names():
     
     
 def is_object_in_scene(object_name):
-    return object_name in get_all_objects_names()
-
-
+    return object_name in bpy.context.scene.objects
+
+
+DATA_COLLECTIONS = {
+    'MESH': 'meshes',
+    'CURVE': 'curves',
+    'MATERIAL': 'materials',
+    'IMAGE': 'images',
+    'ACTION': 'actions',
+    'LIGHT': 'lights',
+    'CAMERA': 'cameras',
+}
+
+
+def count_datablocks():
+    """Number of datablocks of the kinds the pipeline creates, and how many nothing uses"""
+    collections = [getattr(bpy.data, c) for c in ('meshes', 'materials', 'images', 'actions')]
+    return {'objects': len(bpy.data.objects), 'meshes': len(bpy.data.meshes),
+            'materials': len(bpy.data.materials), 'images': len(bpy.data.images),
+            'actions': len(bpy.data.actions),
+            'orphans': sum(d.users == 0 for c in collections for d in c)}
+
+
+def free_orphans(datablocks):
+    """Remove the given datablocks once nothing uses them, then the materials they held.
+    Shared data (linked clones, templates, kept materials) still has users and stays."""
+    freed = 0
+    while datablocks:
+        held = []
+        for data in datablocks:
+            try:
+                if data.users > 0: continue
+            except ReferenceError:
+                continue # already removed through another reference
+            collection = getattr(bpy.data, DATA_COLLECTIONS.get(data.id_type, ''), None)
+            if collection is None: continue
+            held += [m for m in getattr(data, 'materials', ()) if m is not None]
+            collection.remove(data)
+            freed += 1
+        datablocks = held
+    return freed
+            
+            
 def get_active_name():
     """Get the name for the currently active object"""
     return bpy.context.active_object.name
@@ -39,14 +85,26 @@ def set_attribute(object_name, attribute, value):
     setattr(get_object(object_name), attribute, value)
 
 
-def clone_object(object_name, location=(0,0,0)):
-    """Create another identical object"""
+def clone_object(object_name, location=(0,0,0), *, linked=False, collection=None):
+    """Create another identical object, sharing its data if linked"""
+    return clone_objects(object_name, [location], linked=linked, collection=collection)[0]
+
+
+@profiled
+def clone_objects(object_name, locations, *, linked=True, collection=None):
+    """Create one copy of the object per location.
+    Linked copies share the mesh datablock, so memory grows with the number of
+    distinct meshes rather than with the number of copies."""
     old_obj = get_object(object_name)
-    new_obj = old_obj.copy()
-    new_obj.data = old_obj.data.copy()
-    new_obj.location = location
-    bpy.context.collection.objects.link(new_obj)
-    return new_obj.name
+    collection = get_collection(collection)
+    new_names = []
+    for location in locations:
+        new_obj = old_obj.copy()
+        if not linked: new_obj.data = old_obj.data.copy()
+        new_obj.location = location
+        collection.objects.link(new_obj)
+        new_names.append(new_obj.name)
+    return new_names
 
 
 def hide_object(object_name):
@@ -61,21 +119,28 @@ def delete_all_objects(objs = bpy.context.scene.objects):
     bpy.ops.object.delete({"selected_objects": objs})
 
 
-def delete_objects(list_object_names):
+@profiled
+def delete_objects(list_object_names, *, free_data=True):
+    """Remove objects and, with free_data, the mesh, materials and action left unused"""
+    datablocks = []
     for object_name_to_delete in list_object_names:
         object = get_object(object_name_to_delete)
-        object.select_set(True)
+        if free_data:
+            if object.data is not None: datablocks.append(object.data)
+            if object.animation_data and object.animation_data.action:
+                datablocks.append(object.animation_data.action)
         bpy.data.objects.remove(object, do_unlink=True)
+    if datablocks: free_orphans(datablocks)
     
     
-def create_camera(location=(0,0,0), rotation_euler=(0,0,0), *, object_name='Camera'):
+def create_camera(location=(0,0,0), rotation_euler=(0,0,0), *, object_name='Camera', set_active=True):
     camera_data = bpy.data.cameras.new(name=object_name + '-data')
     camera_object = bpy.data.objects.new(object_name, camera_data)
     camera_object.location = location
     camera_object.rotation_euler = rotation_euler
     camera_object.name = object_name
     bpy.context.scene.collection.objects.link(camera_object)
-    bpy.context.scene.camera = bpy.data.objects[camera_object.name]
+    if set_active: bpy.context.scene.camera = bpy.data.objects[camera_object.name]
     return camera_object.name
     #object = bpy.ops.object.camera_add(location=location, rotation=rotation_euler)
     #bpy.context.scene.camera = bpy.context.object
@@ -83,6 +148,21 @@ def create_camera(location=(0,0,0), rotation_euler=(0,0,0), *, object_name='Came
     #return object.name
     
     
+def get_camera_footprint(camera_name=None, *, z=0., scene=None):
+    """Corners (4, 2) of the area the camera sees on the horizontal plane at height z"""
+    scene = scene or bpy.context.scene
+    camera = get_object(camera_name) if camera_name else scene.camera
+    matrix = camera.matrix_world
+    corners = np.array([tuple(matrix @ c) for c in camera.data.view_frame(scene=scene)])
+    if camera.data.type == 'ORTHO':
+        origins = corners
+        directions = np.tile(np.array(matrix.to_3x3().col[2]) * -1., (4, 1))
+    else:
+        origins = np.array(matrix.translation)
+        directions = corners - origins
+    return geometry.floor_footprint(origins, directions, z=z, far=camera.data.clip_end)
+    
+    
 def create_light(energy=100000, location=(0,0,0), type='POINT', *, object_name='Light'):
     light_data = bpy.data.lights.new(name=object_name + "-data", type=type)        
     light_data.energy = energy
@@ -105,12 +185,13 @@ def create_color_material(color, specular_intensity=1, *, material_name='new_col
     material = bpy.data.materials.new(material_name)
 
     material.specular_intensity = specular_intensity
+    material.diffuse_color = color # viewport and workbench color
 
     # Activate its nodes
     material.use_nodes = True
 
     # Get the principled BSDF (created by default)
-    principled = material.node_tree.nodes['Principled BSDF']
+    principled = next(n for n in material.node_tree.nodes if n.type == 'BSDF_PRINCIPLED')
 
     # Assign the color
     principled.inputs['Base Color'].default_value = color
@@ -118,56 +199,145 @@ def create_color_material(color, specular_intensity=1, *, material_name='new_col
     return material
     
     
+def get_color_material(color, specular_intensity=1):
+    """One shared material per color and specular intensity, kept with a fake user"""
+    material_name = 'Color_' + '_'.join('%.3f' % c for c in color) + '_S%.2f' % specular_intensity
+    material = bpy.data.materials.get(material_name)
+    if material is None:
+        material = create_color_material(color, specular_intensity, material_name=material_name)
+        material.use_fake_user = True
+    return material
+    
+    
 def append_material(object_name, material):
     get_object(object_name).data.materials.append(material)
         
 
 def paint_color(object_name, color, specular_intensity=1):
-    material = create_color_material(color, specular_intensity)
+    material = get_color_material(color, specular_intensity)
     append_material(object_name, material)
     
+    
+def get_collection(collection=None):
+    """Collection to link new objects to, defaults to the one in context"""
+    return collection if collection is not None else bpy.context.collection
+
+
+def set_mesh_geometry(mesh, vertices, faces):
+    """Replace mesh geometry in bulk; faces is an (F, corners) array or a list of polygons"""
+    vertices = np.asarray(vertices, dtype=np.float32).reshape(-1, 3)
+    if isinstance(faces, np.ndarray) and faces.ndim == 2:
+        loop_totals = np.full(len(faces), faces.shape[1], dtype=np.int32)
+        loop_vertices = faces.astype(np.int32).ravel()
+    else:
+        loop_totals = np.array([len(f) for f in faces], dtype=np.int32)
+        loop_vertices = np.concatenate([np.asarray(f, dtype=np.int32) for f in faces]) \
+            if len(faces) else np.zeros(0, dtype=np.int32)
+    loop_starts = np.zeros(len(loop_totals), dtype=np.int32)
+    loop_starts[1:] = np.cumsum(loop_totals)[:-1]
+    
+    mesh.clear_geometry()
+    mesh.vertices.add(len(vertices))
+    mesh.vertices.foreach_set('co', vertices.ravel())
+    mesh.loops.add(len(loop_vertices))
+    mesh.loops.foreach_set('vertex_index', loop_vertices)
+    mesh.polygons.add(len(loop_totals))
+    mesh.polygons.foreach_set('loop_start', loop_starts)
+    mesh.polygons.foreach_set('loop_total', loop_totals)
+    mesh.update(calc_edges=True)
+    return mesh
+
+
+def set_mesh_coordinates(mesh, vertices):
+    """Move the vertices of a mesh in place, keeping its topology"""
+    mesh.vertices.foreach_set('co', np.asarray(vertices, dtype=np.float32).ravel())
+    mesh.update()
+    return mesh
+
+
+def set_mesh_vertex_blocks(mesh, vertices, blocks):
+    """Move the vertices of some blocks in place; vertices is (blocks, block size, 3)
+    for the whole mesh. Few blocks are written vertex by vertex, so the cost follows
+    what changed; many are written in one bulk call."""
+    if len(blocks) == 0: return mesh
+    if 2 * len(blocks) > len(vertices): return set_mesh_coordinates(mesh, vertices)
+    block_size = vertices.shape[1]
+    mesh_vertices = mesh.vertices
+    for block in np.asarray(blocks).tolist():
+        for index, co in enumerate(vertices[block].tolist(), block * block_size):
+            mesh_vertices[index].co = co
+    mesh.update()
+    return mesh
+
+
+def create_mesh_objects(mesh, object_names,
+        *, locations=None, rotations_euler=None, scales=None, collection=None):
+    """Create one object per name, all sharing the same mesh datablock"""
+    collection = get_collection(collection)
+    objects = []
+    for o, object_name in enumerate(object_names):
+        object = bpy.data.objects.new(object_name, mesh)
+        if locations is not None: object.location = locations[o]
+        if rotations_euler is not None: object.rotation_euler = rotations_euler[o]
+        if scales is not None: object.scale = scales[o]
+        collection.objects.link(object)
+        objects.append(object)
+    return [o.name for o in objects]
+
+
+@profiled
+def create_mesh(vertices, faces,
+        *, object_name='Mesh', location=(0,0,0), color=None, specular_intensity=1, collection=None):
+    """Create an object from vertex/face arrays through the data API"""
+    mesh = set_mesh_geometry(bpy.data.meshes.new(object_name + '-data'), vertices, faces)
+    if color: mesh.materials.append(get_color_material(color, specular_intensity))
+    return create_mesh_objects(mesh, [object_name], locations=[location], collection=collection)[0]
+    
  
 def add_plane(size=1,
-        *, location=(0,0,0), object_name='Plane'):
-    bpy.ops.mesh.primitive_plane_add(
-        enter_editmode=False,
-        size=size,
-        align='WORLD',
-        location=location,
-        )
-    object = bpy.context.selected_objects[0]
-    object.name = object_name
-    return object.name
+        *, location=(0,0,0), object_name='Plane', collection=None):
+    vertices, faces = geometry.plane_mesh(size)
+    return create_mesh(vertices, faces, object_name=object_name, location=location,
+        collection=collection)
     
     
+@profiled
+def create_cylinders(locations, radius=1, depth=1,
+        *, object_name='Cylinder', color=None, specular_intensity=1, collection=None):
+    """Create one cylinder per location, sharing one mesh and one material"""
+    vertices, faces = geometry.cylinder_mesh(radius, depth)
+    mesh = set_mesh_geometry(bpy.data.meshes.new(object_name + '-data'), vertices, faces)
+    if color: mesh.materials.append(get_color_material(color, specular_intensity))
+    object_names = [object_name] if len(locations) == 1 else \
+        [object_name + '.' + str(i).zfill(3) for i in range(len(locations))]
+    return create_mesh_objects(mesh, object_names, locations=locations, collection=collection)
+
+
 def create_cylinder(radius=1, depth=1,
         *, object_name='Cylinder', location=(0,0,0),
-        color=None, specular_intensity=1):
-    bpy.ops.mesh.primitive_cylinder_add(enter_editmode=False,
-        align='WORLD', radius=radius, depth=depth)
-    object = bpy.context.selected_objects[0]
-    object.name = object_name
-    object.location = location
-    if color: paint_color(object.name, color, specular_intensity)
-    return object.name
+        color=None, specular_intensity=1, collection=None):
+    return create_cylinders([location], radius, depth, object_name=object_name,
+        color=color, specular_intensity=specular_intensity, collection=collection)[0]
+
+
+@profiled
+def create_rectangles(dimensions, locations, rotations_euler=None,
+        *, object_name='Rectangle', color=None, specular_intensity=1, collection=None):
+    """Create one box per dimensions/location pair, sharing a unit cube mesh scaled per object"""
+    vertices, faces = geometry.box_mesh()
+    mesh = set_mesh_geometry(bpy.data.meshes.new(object_name + '-data'), vertices, faces)
+    if color: mesh.materials.append(get_color_material(color, specular_intensity))
+    object_names = [object_name] if len(locations) == 1 else \
+        [object_name + '.' + str(i).zfill(3) for i in range(len(locations))]
+    return create_mesh_objects(mesh, object_names, locations=locations,
+        rotations_euler=rotations_euler, scales=dimensions, collection=collection)
 
 
 def create_rectangle(dimensions=(1,1,1),
         *, object_name='Rectangle', location=(0,0,0), rotation_euler=(0,0,0),
-        color=None, specular_intensity=1):
-    length_infinitesimal = 0.01
-    bpy.ops.mesh.primitive_cube_add(
-        enter_editmode=False,
-        size=length_infinitesimal,
-        align='WORLD',
-        scale=[d / length_infinitesimal for d in dimensions],
-        )
-    object = bpy.context.selected_objects[0]
-    object.name = object_name
-    object.rotation_euler = rotation_euler
-    object.location = location
-    if color: paint_color(object.name, color, specular_intensity)
-    return object.name
+        color=None, specular_intensity=1, collection=None):
+    return create_rectangles([dimensions], [location], [rotation_euler], object_name=object_name,
+        color=color, specular_intensity=specular_intensity, collection=collection)[0]
     
     
 def group_objects(object_names):
@@ -179,54 +349,42 @@ def group_objects(object_names):
     return object.name
 
 
+@profiled
 def create_lane_on_floor(coords2D,
         *, wide=1., thick=.1, color=None, specular_intensity=1, object_name='Lane'):
     
     circle_radius = float(wide) / 2
     
-    path_object_names = []
+    points = np.asarray(coords2D, dtype=float).reshape(-1, 2)
+    if len(points) < 2: return []
     
-    material_lane = create_color_material(color, specular_intensity)
-            
-    for p, (point1, point2) in enumerate(zip(coords2D[:-1], coords2D[1:])):
-        
-        point1 = [float(p) for p in point1]
-        point2 = [float(p) for p in point2]
-        
-        if p > 0:
-            cylinder_name = create_cylinder(
-                object_name = 'Path_Circle.' + str(p).zfill(3),
-                radius = circle_radius, depth = thick,
-                location = (point1[0], point1[1], 0))
-                
-            append_material(cylinder_name, material_lane)
-                        
-            path_object_names.append(cylinder_name)
-            
-        
-        line_length = math.dist(point1, point2)
-        
-        # create rectangle object
-        heading = math.atan2(point2[1] - point1[1], point2[0] - point1[0])
-        rect_center = [(float(c1) + float(c2)) / 2. for c1, c2 in zip(point1, point2)]
-        
-        rectangle_name = create_rectangle(
-            object_name = 'Path_Rect.' + str(p).zfill(3),
-            dimensions = (line_length, wide , thick * 1.5),
-            location = (rect_center[0], rect_center[1], 0),
-            rotation_euler = (0, 0, heading))
-                
-        append_material(rectangle_name, material_lane)
+    # one rectangle per segment, one cylinder per inner point
+    starts, ends = points[:-1], points[1:]
+    centers = (starts + ends) / 2.
+    lengths = np.hypot(*(ends - starts).T)
+    headings = np.arctan2(*(ends - starts).T[::-1])
+    
+    rectangle_names = create_rectangles(
+        dimensions = [(l, wide, thick * 1.5) for l in lengths],
+        locations = [(c[0], c[1], 0) for c in centers],
+        rotations_euler = [(0, 0, h) for h in headings],
+        object_name = 'Path_Rect', color = color, specular_intensity = specular_intensity)
         
-        if p > 0:
-            # remove undesired dark artifacts created at rectangle intersections
-            bpy.ops.object.modifier_add(type='BOOLEAN')
-            previous_rectangle_name = path_object_names[-2]
-            bpy.context.object.modifiers["Boolean"].object = bpy.data.objects[previous_rectangle_name]
-            bpy.context.object.modifiers["Boolean"].operation = 'DIFFERENCE'
+    cylinder_names = create_cylinders(
+        locations = [(p[0], p[1], 0) for p in points[1:-1]],
+        radius = circle_radius, depth = thick,
+        object_name = 'Path_Circle', color = color, specular_intensity = specular_intensity) \
+        if len(points) > 2 else []
+    
+    # remove undesired dark artifacts created at rectangle intersections
+    for previous_rectangle_name, rectangle_name in zip(rectangle_names[:-1], rectangle_names[1:]):
+        boolean = get_object(rectangle_name).modifiers.new('Boolean', 'BOOLEAN')
+        boolean.object = get_object(previous_rectangle_name)
+        boolean.operation = 'DIFFERENCE'
             
-        path_object_names.append(rectangle_name)
-
+    path_object_names = [rectangle_names[0]]
+    for cylinder_name, rectangle_name in zip(cylinder_names, rectangle_names[1:]):
+        path_object_names += [cylinder_name, rectangle_name]
 
     return path_object_names
         
@@ -237,6 +395,41 @@ def create_lane_on_floor(coords2D,
     #return object.name
         
         
+@profiled
+def create_lane_curve(coords2D,
+        *, wide=1., thick=.1, color=None, specular_intensity=1, object_name='Lane', collection=None):
+    """Lane as a curve object: a poly spline along the path, beveled into a flat band"""
+    curve = bpy.data.curves.new(object_name + '-data', type='CURVE')
+    curve.dimensions = '3D'
+    curve.bevel_depth = thick / 2.
+    curve.extrude = max(wide - thick, 0.) / 2. # turned sideways by the points' tilt
+    curve.use_fill_caps = True
+    curve.bevel_factor_mapping_end = 'SPLINE' # reveal in proportion to length
+    if color: curve.materials.append(get_color_material(color, specular_intensity))
+    set_curve_points(curve, coords2D)
+    object = bpy.data.objects.new(object_name, curve)
+    get_collection(collection).objects.link(object)
+    return object.name
+
+
+def set_curve_points(curve, coords2D, *, z=0., tilt=math.pi/2):
+    """Write a poly spline in place; the spline is only recreated when its point count changes"""
+    points = np.asarray(coords2D, dtype=np.float32).reshape(-1, 2)
+    spline = curve.splines[0] if len(curve.splines) == 1 else None
+    if spline is None or spline.type != 'POLY' or len(spline.points) != len(points):
+        curve.splines.clear()
+        if len(points) == 0: return curve
+        spline = curve.splines.new('POLY')
+        spline.points.add(len(points) - 1)
+    co = np.ones((len(points), 4), dtype=np.float32)
+    co[:, :2] = points
+    co[:, 2] = z
+    spline.points.foreach_set('co', co.ravel())
+    spline.points.foreach_set('tilt', np.full(len(points), tilt, dtype=np.float32))
+    curve.update_tag()
+    return curve
+
+
 def setup_animation(frame_end=3, fps=10, *, frame_start=0):
     bpy.context.scene.render.fps = fps    
     bpy.data.scenes['Scene'].frame_start = frame_start
@@ -246,12 +439,86 @@ def setup_animation(frame_end=3, fps=10, *, frame_start=0):
     
 def add_keyframe_sequence(object_name, attribute, frames_values):
     """Add sequence of keyframes to an object"""
+    frames = list(frames_values.keys())
+    values = [frames_values[f] for f in frames]
+    add_keyframes(object_name, attribute, frames, values, replace=False)
+
+
+def get_fcurve(object, data_path, index=0, *, replace=False):
+    """F-curve of the object's action, creating the action and curve if needed"""
+    animation_data = object.animation_data or object.animation_data_create()
+    if animation_data.action is None:
+        animation_data.action = bpy.data.actions.new(object.name + 'Action')
+    fcurves = animation_data.action.fcurves
+    fcurve = fcurves.find(data_path, index=index)
+    if fcurve is not None and replace:
+        fcurves.remove(fcurve)
+        fcurve = None
+    if fcurve is None:
+        fcurve = fcurves.new(data_path, index=index, action_group=object.name)
+    return fcurve
+
+
+INTERPOLATION_MODES = {'CONSTANT': 0, 'LINEAR': 1, 'BEZIER': 2}
+
+
+def set_interpolation(keyframe_points, interpolation):
+    try:
+        keyframe_points.foreach_set('interpolation',
+            [INTERPOLATION_MODES[interpolation]] * len(keyframe_points))
+    except TypeError:
+        for keyframe_point in keyframe_points:
+            keyframe_point.interpolation = interpolation
+
+
+@profiled
+def add_keyframes(object_name, data_path, frames, values,
+        *, index=None, interpolation='BEZIER', replace=True):
+    """Key a property at many frames at once.
+    values has one row per frame: scalars for a single F-curve (given index, 0 by default),
+    or vectors keyed on one F-curve per component (starting at index, 0 by default).
+    Existing keys on those F-curves are replaced unless replace is False."""
     object = get_object(object_name)
-    for f, v in frames_values.items():
-        setattr(object, attribute, v)
-        object.keyframe_insert(data_path=attribute, frame=f)
+    frames = np.asarray(frames, dtype=np.float32).ravel()
+    values = np.asarray(values, dtype=np.float32).reshape(len(frames), -1)
+    first_index = 0 if index is None else index
+    
+    for component in range(values.shape[1]):
+        fcurve = get_fcurve(object, data_path, first_index + component, replace=replace)
+        keyframe_points = fcurve.keyframe_points
+        
+        co = np.empty((len(frames), 2), dtype=np.float32)
+        co[:, 0] = frames
+        co[:, 1] = values[:, component]
+        existing = len(keyframe_points)
+        if existing > 0:
+            old_co = np.empty(2 * existing, dtype=np.float32)
+            keyframe_points.foreach_get('co', old_co)
+            co = np.concatenate((old_co.reshape(-1, 2), co))
+        
+        keyframe_points.add(len(frames))
+        keyframe_points.foreach_set('co', co.ravel())
+        set_interpolation(keyframe_points, interpolation)
+        fcurve.update() # sort keys and recalculate handles
 
 
+def remove_keyframes_before(object_name, data_path, frame):
+    """Drop a property's keys before frame, so a rolling animation stays bounded"""
+    object = get_object(object_name)
+    action = object.animation_data.action if object.animation_data else None
+    if action is None: return
+    for fcurve in action.fcurves:
+        if fcurve.data_path != data_path: continue
+        keyframe_points = fcurve.keyframe_points
+        co = np.empty(2 * len(keyframe_points), dtype=np.float32)
+        keyframe_points.foreach_get('co', co)
+        old = [p for p, f in zip(keyframe_points, co[0::2]) if f < frame]
+        for keyframe_point in reversed(old):
+            keyframe_points.remove(keyframe_point, fast=True)
+        if old: fcurve.update()
+
+
+@profiled
 def import_fbx(filepath,
         *, object_name='MyNewObject', location=(0,0,0), rotation_euler=(0,0,0), scale=(1,1,1)):
     bpy.ops.import_scene.fbx(filepath=filepath)
@@ -264,20 +531,269 @@ def import_fbx(filepath,
     return object.name
 
 
+@profiled
 def import_obj(filepath):  
     status = bpy.ops.import_scene.obj(filepath=filepath)
     object_names = [o.name for o in bpy.context.selected_objects]
     return object_names
     
     
-def render_animation(filename):
+@profiled
+def decimate_object(object_name, ratio, *, new_object_name=None, collection=None):
+    """Copy of the object with a decimated copy of its mesh, built without operators"""
+    object = get_object(object_name)
+    hide_viewport = object.hide_viewport
+    object.hide_viewport = False # hidden objects are not evaluated
+    modifier = object.modifiers.new('LOD_Decimate', 'DECIMATE')
+    modifier.ratio = ratio
+    try:
+        depsgraph = bpy.context.evaluated_depsgraph_get()
+        mesh = bpy.data.meshes.new_from_object(object.evaluated_get(depsgraph),
+            preserve_all_data_layers=True, depsgraph=depsgraph)
+    finally:
+        object.modifiers.remove(modifier)
+        object.hide_viewport = hide_viewport
+    
+    new_object = object.copy()
+    new_object.data = mesh
+    new_object.name = new_object_name or object.name + '_Decimated'
+    mesh.name = new_object.name + '-data'
+    get_collection(collection).objects.link(new_object)
+    return new_object.name
+    
+    
+def downscale_image(image, max_size, filepath):
+    """Image no larger than max_size pixels per side, saved once to filepath and reloaded after"""
+    if os.path.exists(filepath):
+        return bpy.data.images.load(filepath, check_existing=True)
+    width, height = image.size
+    scale = min(1., float(max_size) / max(width, height, 1))
+    proxy = image.copy()
+    proxy.scale(max(1, int(width * scale)), max(1, int(height * scale)))
+    os.makedirs(os.path.dirname(os.path.abspath(filepath)), exist_ok=True)
+    proxy.filepath_raw = filepath
+    proxy.file_format = 'JPEG'
+    proxy.save()
+    return proxy
+    
+    
+def use_texture_proxies(object_name, max_size, texture_folder):
+    """Give the object's mesh copies of its materials that sample downscaled textures"""
+    mesh = get_object(object_name).data
+    for m, material in enumerate(mesh.materials):
+        if material is None or not material.use_nodes: continue
+        proxy_material = material.copy()
+        proxy_material.name = material.name + '_' + str(max_size)
+        for node in proxy_material.node_tree.nodes:
+            if node.type == 'TEX_IMAGE' and node.image is not None:
+                image_name = os.path.splitext(os.path.basename(node.image.filepath or node.image.name))[0]
+                node.image = downscale_image(node.image, max_size,
+                    os.path.join(texture_folder, image_name + '_' + str(max_size) + '.jpg'))
+        mesh.materials[m] = proxy_material
+        
+        
+def get_hierarchy_names(object_name):
+    """Names of the object and all its descendants"""
+    object_names = [object_name]
+    for child in get_object(object_name).children:
+        object_names += get_hierarchy_names(child.name)
+    return object_names
+    
+    
+@profiled
+def save_library(filepath, object_names):
+    """Write objects, with the data and materials they use, to a .blend library"""
+    os.makedirs(os.path.dirname(os.path.abspath(filepath)), exist_ok=True)
+    objects = {bpy.data.objects[n] for n in object_names}
+    temporary_filepath = filepath + '.tmp.blend'
+    bpy.data.libraries.write(temporary_filepath, objects, path_remap='ABSOLUTE', fake_user=True)
+    os.replace(temporary_filepath, filepath)
+    return filepath
+    
+    
+@profiled
+def load_library(filepath, object_names=None, *, link=False, collection=None):
+    """Append (or link) objects from a .blend library into the scene"""
+    with bpy.data.libraries.load(filepath, link=link) as (data_from, data_to):
+        data_to.objects = [n for n in data_from.objects
+            if (object_names is None) or (n in object_names)]
+    collection = get_collection(collection)
+    for object in data_to.objects:
+        if object is not None: collection.objects.link(object)
+    return [o.name for o in data_to.objects if o is not None]
+    
+    
+def get_render_settings(scene=None):
+    """Scene settings that change the rendered pixels or the output file"""
+    scene = scene or bpy.context.scene
+    render = scene.render
+    settings = {
+        'engine': render.engine,
+        'resolution': (render.resolution_x, render.resolution_y, render.resolution_percentage),
+        'fps': (render.fps, render.fps_base),
+        'frames': (scene.frame_start, scene.frame_end, scene.frame_step),
+        'file_format': render.image_settings.file_format,
+        'ffmpeg': (render.ffmpeg.format, render.ffmpeg.codec, render.ffmpeg.constant_rate_factor),
+        'film_transparent': render.film_transparent,
+        'camera': get_camera_settings(scene.camera) if scene.camera else None,
+    }
+    if render.engine == 'CYCLES':
+        settings['samples'] = (scene.cycles.samples, scene.cycles.device, scene.cycles.max_bounces)
+    elif render.engine == 'BLENDER_EEVEE':
+        settings['samples'] = scene.eevee.taa_render_samples
+    elif render.engine == 'BLENDER_WORKBENCH':
+        settings['samples'] = scene.display.render_aa
+    return settings
+    
+    
+def get_camera_settings(camera):
+    """Placement and projection of a camera object, as plain values"""
+    data = camera.data
+    return {
+        'name': camera.name,
+        'matrix_world': [list(row) for row in camera.matrix_world],
+        'projection': (data.type, data.lens, data.ortho_scale, data.sensor_fit,
+            data.sensor_width, data.sensor_height, data.shift_x, data.shift_y),
+        'clip': (data.clip_start, data.clip_end),
+    }
+    
+    
+def get_render_quality(scene=None):
+    """Settings a render profile may change, to restore them before applying another"""
+    scene = scene or bpy.context.scene
+    return {
+        'engine': scene.render.engine,
+        'resolution_percentage': scene.render.resolution_percentage,
+        'cycles_samples': scene.cycles.samples,
+        'device': scene.cycles.device,
+        'cycles_bounces': scene.cycles.max_bounces,
+        'eevee_samples': scene.eevee.taa_render_samples,
+        'workbench_aa': scene.display.render_aa,
+    }
+    
+    
+def set_render_quality(*, engine=None, resolution_percentage=None, cycles_samples=None, device=None,
+        cycles_bounces=None, eevee_samples=None, workbench_aa=None, scene=None):
+    """Change the given quality settings, leaving the others as they are"""
+    scene = scene or bpy.context.scene
+    if engine is not None: scene.render.engine = engine
+    if resolution_percentage is not None: scene.render.resolution_percentage = resolution_percentage
+    if cycles_samples is not None: scene.cycles.samples = cycles_samples
+    if device is not None: scene.cycles.device = device
+    if cycles_bounces is not None: scene.cycles.max_bounces = cycles_bounces
+    if eevee_samples is not None: scene.eevee.taa_render_samples = eevee_samples
+    if workbench_aa is not None: scene.display.render_aa = workbench_aa
+    
+    
+@profiled
+def render_animation(filename, *, output_folder=None, cache=None, cache_key=None, resumable=False):
+    """Render the scene animation to an MP4.
+    With a cache and a key, a file rendered before with the same key is reused;
+    the key also tells resumable renders whether their checkpointed frames still apply.
+    Resumable renders go through a checkpointed frame sequence that is encoded
+    once complete, so a restart continues where the previous run stopped."""
     output_path = bpy.context.scene.render.filepath
-    output_filename = os.path.join(output_path, filename + ".mp4")
-    bpy.context.scene.render.filepath = output_filename
+    output_folder = output_path if output_folder is None else output_folder
+    output_filename = os.path.join(output_folder, filename + ".mp4")
+    if cache is not None and cache_key is not None and cache.restore(cache_key, output_filename):
+        print('Reused cached render', output_filename)
+        return output_filename
+        
+    if resumable:
+        frames_folder = os.path.join(output_folder, filename + '_frames')
+        missing_frames = render_frames_resumable(frames_folder, content_key=cache_key)
+        if missing_frames:
+            print('Failed rendering', output_filename, '- missing frames', missing_frames)
+            return None
+        scene = bpy.context.scene
+        video.encode_frames(os.path.join(frames_folder, '%05d' + scene.render.file_extension),
+            output_filename, scene.render.fps, frame_start=scene.frame_start)
+        
+    else:
+        bpy.context.scene.render.filepath = output_filename
+        try:
+            bpy.ops.render.render(animation=True, write_still=True )
+        except:
+            print('Failed rendering', output_filename)        
+            output_filename = None
+        bpy.context.scene.render.filepath = output_path
+    
+    if output_filename and cache is not None and cache_key is not None:
+        cache.store(cache_key, output_filename)
+    return output_filename
+    
+    
+@profiled
+def render_frames(output_folder, frame_start=None, frame_end=None, *, file_format='PNG'):
+    """Render a frame range as an image sequence named by frame number"""
+    scene = bpy.context.scene
+    saved = (scene.render.filepath, scene.render.image_settings.file_format,
+        scene.frame_start, scene.frame_end)
+    scene.render.image_settings.file_format = file_format
+    scene.render.filepath = os.path.join(output_folder, '#####')
+    if frame_start is not None: scene.frame_start = frame_start
+    if frame_end is not None: scene.frame_end = frame_end
     try:
-        bpy.ops.render.render(animation=True, write_still=True )
+        bpy.ops.render.render(animation=True)
     except:
-        print('Failed rendering', output_filename)        
+        print('Failed rendering frames', scene.frame_start, 'to', scene.frame_end)
+        
+    (scene.render.filepath, scene.render.image_settings.file_format,
+        scene.frame_start, scene.frame_end) = saved
+        
+        
+@profiled
+def render_frames_resumable(output_folder, frame_start=None, frame_end=None, *, file_format='PNG',
+        content_key=None):
+    """Render a frame range one frame at a time, recording every finished frame
+    in a manifest; frames already recorded are skipped. Returns the missing frames.
+    content_key identifies the scene content, so frames of an older scene are dropped."""
+    scene = bpy.context.scene
+    frame_start = scene.frame_start if frame_start is None else frame_start
+    frame_end = scene.frame_end if frame_end is None else frame_end
+    saved = (scene.render.filepath, scene.render.image_settings.file_format, scene.frame_current)
+    scene.render.image_settings.file_format = file_format
+    os.makedirs(output_folder, exist_ok=True)
+    
+    # a manifest per range, so workers rendering other ranges of the folder never share one
+    manifest_filepath = os.path.join(output_folder,
+        'manifest_' + str(frame_start).zfill(5) + '_' + str(frame_end).zfill(5) + '.json')
+    settings = get_render_settings(scene)
+    del settings['frames']
+    settings['content'] = content_key
+    settings = json.loads(json.dumps(settings))
+    manifest = {'settings': settings, 'frames': []}
+    
+    def frame_filepath(frame):
+        return os.path.join(output_folder, str(frame).zfill(5) + scene.render.file_extension)
     
-    bpy.context.scene.render.filepath = output_path
-    
\ No newline at end of file
+    if os.path.exists(manifest_filepath):
+        with open(manifest_filepath, 'r') as f:
+            previous_manifest = json.load(f)
+        if previous_manifest.get('settings') == settings:
+            manifest = previous_manifest
+        else:
+            # rendered from other settings or another scene, never to be encoded
+            for frame in previous_manifest.get('frames', []):
+                if os.path.exists(frame_filepath(frame)): os.remove(frame_filepath(frame))
+            os.remove(manifest_filepath)
+    
+    done_frames = set(f for f in manifest['frames'] if os.path.exists(frame_filepath(f)))
+    try:
+        for frame in range(frame_start, frame_end + 1):
+            if frame in done_frames: continue
+            scene.frame_set(frame)
+            scene.render.filepath = frame_filepath(frame)
+            bpy.ops.render.render(write_still=True)
+            
+            done_frames.add(frame)
+            manifest['frames'] = sorted(done_frames)
+            with open(manifest_filepath + '.tmp', 'w') as f:
+                json.dump(manifest, f)
+            os.replace(manifest_filepath + '.tmp', manifest_filepath)
+    except:
+        print('Failed rendering frame', scene.frame_current)
+        
+    (scene.render.filepath, scene.render.image_settings.file_format, current_frame) = saved
+    scene.frame_set(current_frame)
+    return [f for f in range(frame_start, frame_end + 1) if f not in done_frames]
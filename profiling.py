@@ -0,0 +1,147 @@
+import contextlib
+import csv
+import functools
+import json
+import os
+import sys
+import time
+
+
+def current_rss():
+    """Resident memory of this process in bytes, None where it cannot be read"""
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss
+    except ImportError:
+        pass
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024 # peak, not current
+    except ImportError:
+        return None
+
+
+class Profiler:
+    """Opt-in timings of pipeline stages, grouped by take.
+    Disabled profilers cost one attribute check per instrumented call."""
+
+    def __init__(self):
+        self.enabled = False
+        self.counters = None
+        self.current_take = None
+        self.stages = {}
+        self.takes = []
+
+
+    def enable(self, counters=None):
+        """Start recording; counters() may return a dict of object/datablock counts"""
+        self.enabled = True
+        self.counters = counters
+        self.stages = {}
+        self.takes = []
+
+
+    def disable(self):
+        self.enabled = False
+
+
+    def add(self, name, wall, cpu):
+        key = (self.current_take, name)
+        stage = self.stages.setdefault(key, {'calls': 0, 'wall': 0., 'cpu': 0.})
+        stage['calls'] += 1
+        stage['wall'] += wall
+        stage['cpu'] += cpu
+
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        if not self.enabled:
+            yield
+            return
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - wall, time.process_time() - cpu)
+
+
+    def profiled(self, name=None):
+        """Decorator recording every call of a function as a stage"""
+        def decorator(function):
+            stage_name = name or function.__qualname__
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                if not self.enabled: return function(*args, **kwargs)
+                with self.stage(stage_name):
+                    return function(*args, **kwargs)
+            return wrapper
+        return decorator
+
+
+    @contextlib.contextmanager
+    def take(self, take):
+        """Attribute nested stages to a take and snapshot memory and counts after it"""
+        if not self.enabled:
+            yield
+            return
+        previous_take, self.current_take = self.current_take, take
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            row = {'take': take, 'wall': time.perf_counter() - wall,
+                   'cpu': time.process_time() - cpu, 'rss': current_rss()}
+            if self.counters is not None: row.update(self.counters())
+            self.takes.append(row)
+            self.current_take = previous_take
+
+
+    def stage_rows(self):
+        return [dict(take=take, stage=name, **stage) for (take, name), stage in self.stages.items()]
+
+
+    def totals(self):
+        """Stages summed over all takes, slowest first"""
+        totals = {}
+        for (take, name), stage in self.stages.items():
+            total = totals.setdefault(name, {'calls': 0, 'wall': 0., 'cpu': 0.})
+            for k in total: total[k] += stage[k]
+        return dict(sorted(totals.items(), key=lambda item: -item[1]['wall']))
+
+
+    def write_report(self, filepath):
+        """JSON report at filepath, plus <name>_stages.csv and <name>_takes.csv beside it"""
+        folder = os.path.dirname(os.path.abspath(filepath))
+        os.makedirs(folder, exist_ok=True)
+        with open(filepath, 'w') as f:
+            json.dump({'totals': self.totals(), 'stages': self.stage_rows(), 'takes': self.takes},
+                f, indent=1)
+
+        root = os.path.splitext(filepath)[0]
+        for suffix, rows in (('_stages.csv', self.stage_rows()), ('_takes.csv', self.takes)):
+            if not rows: continue
+            fieldnames = list(dict.fromkeys(k for row in rows for k in row))
+            with open(root + suffix, 'w', newline='') as f:
+                writer = csv.DictWriter(f, fieldnames=fieldnames)
+                writer.writeheader()
+                writer.writerows(rows)
+        return filepath
+
+
+PROFILER = Profiler()
+
+
+def profiled(function=None, *, name=None):
+    """Record calls of a function on the shared profiler; usable with or without arguments"""
+    decorator = PROFILER.profiled(name)
+    return decorator(function) if function is not None else decorator
+
+
+def stage(name):
+    return PROFILER.stage(name)
@@ -0,0 +1,69 @@
+import bpy
+
+
+ROLE_KEY = 'indiana_role'
+TREE_TYPE_KEY = 'indiana_tree_type'
+
+ROLE_ROBOT = 'robot'
+ROLE_PATH = 'path'
+ROLE_TREE = 'tree'
+ROLE_TREE_TEMPLATE = 'tree_template'
+ROLE_TREE_LOD = 'tree_lod'
+
+
+class ObjectRegistry:
+    """Indexes of the scene objects created by IndianaDrones.
+    Every registered object is also tagged with custom properties, so the
+    indexes can be rebuilt from a saved .blend with a single scene scan."""
+
+    def __init__(self):
+        self.clear()
+
+
+    def register(self, object_name, role, *, tree_type=None):
+        object = bpy.data.objects[object_name]
+        object[ROLE_KEY] = role
+        if tree_type is not None: object[TREE_TYPE_KEY] = tree_type
+        self._index(object_name, role, tree_type)
+
+
+    def _index(self, object_name, role, tree_type):
+        if object_name in self.tags_by_name: self.unregister(object_name)
+        self.tags_by_name[object_name] = (role, tree_type)
+        self.names_by_role.setdefault(role, set()).add(object_name)
+        if role == ROLE_TREE_TEMPLATE: self.tree_templates[tree_type] = object_name
+
+
+    def unregister(self, object_name):
+        role, tree_type = self.tags_by_name.pop(object_name, (None, None))
+        self.names_by_role.get(role, set()).discard(object_name)
+        if self.tree_templates.get(tree_type) == object_name: del self.tree_templates[tree_type]
+
+
+    def clear(self):
+        self.names_by_role = {}
+        self.tree_templates = {}
+        self.tags_by_name = {}
+
+
+    def rebuild(self, objects=None):
+        """Rebuild the indexes from the tags stored in the objects"""
+        self.clear()
+        objects = bpy.context.scene.objects if objects is None else objects
+        for object in objects:
+            role = object.get(ROLE_KEY)
+            if role is not None:
+                self._index(object.name, role, object.get(TREE_TYPE_KEY))
+        return len(self.tags_by_name)
+
+
+    def names(self, role):
+        return set(self.names_by_role.get(role, ()))
+
+
+    def role(self, object_name):
+        return self.tags_by_name.get(object_name, (None, None))[0]
+
+
+    def get_tree_template(self, tree_type):
+        return self.tree_templates.get(tree_type)
@@ -0,0 +1,67 @@
+import hashlib
+import json
+import os
+import shutil
+
+
+_file_digests = {}
+
+
+def file_digest(filepath, *, chunk_size=1 << 20):
+    """SHA-256 of a file, remembered while its size and mtime do not change"""
+    stat = os.stat(filepath)
+    signature = (os.path.abspath(filepath), stat.st_size, stat.st_mtime_ns)
+    if signature not in _file_digests:
+        digest = hashlib.sha256()
+        with open(filepath, 'rb') as f:
+            for chunk in iter(lambda: f.read(chunk_size), b''):
+                digest.update(chunk)
+        _file_digests[signature] = digest.hexdigest()
+    return _file_digests[signature]
+
+
+def data_digest(data):
+    """SHA-256 of JSON-serializable data, independent of dict ordering"""
+    text = json.dumps(data, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+class RenderCache:
+    """Rendered files stored by the digest of everything that went into them"""
+
+    def __init__(self, cache_folder):
+        self.cache_folder = cache_folder
+        os.makedirs(cache_folder, exist_ok=True)
+
+
+    def path(self, key, extension='.mp4'):
+        return os.path.join(self.cache_folder, key + extension)
+
+
+    def lookup(self, key, extension='.mp4'):
+        cached_filepath = self.path(key, extension)
+        return cached_filepath if os.path.exists(cached_filepath) else None
+
+
+    def store(self, key, filepath):
+        """Keep a copy of a freshly rendered file"""
+        if not os.path.exists(filepath): return None
+        cached_filepath = self.path(key, os.path.splitext(filepath)[1])
+        temporary_filepath = cached_filepath + '.tmp'
+        shutil.copyfile(filepath, temporary_filepath)
+        os.replace(temporary_filepath, cached_filepath)
+        return cached_filepath
+
+
+    def restore(self, key, filepath):
+        """Put the cached file at filepath; returns False on a miss"""
+        cached_filepath = self.lookup(key, os.path.splitext(filepath)[1])
+        if cached_filepath is None: return False
+        if os.path.abspath(cached_filepath) != os.path.abspath(filepath):
+            os.makedirs(os.path.dirname(os.path.abspath(filepath)), exist_ok=True)
+            if os.path.exists(filepath): os.remove(filepath)
+            try:
+                os.link(cached_filepath, filepath)
+            except OSError:
+                shutil.copyfile(cached_filepath, filepath)
+        return True
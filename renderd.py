@@ -0,0 +1,130 @@
+"""Long-lived headless render service around IndianaDrones.
+
+The static scene (camera, lights, floor, robot, tree templates) is loaded
+once; every job only rebuilds the dynamic objects and renders.
+
+    blender -b scene.blend -P renderd.py -- --spool /path/to/spool
+    blender -b scene.blend -P renderd.py -- --port 8765
+
+A job is a JSON object:
+    {"id": "run42", "sim": "coordinates.json", "takes": [0, 1, 2], "output": "/renders"}
+with optional "all_takes", "timeline" and "resumable" booleans and a "cameras"
+list of camera rigs to render each take from. Spool jobs are
+files in <spool>/incoming and results are written to <spool>/results; socket
+jobs are one JSON line per connection, answered with one JSON line.
+"""
+import argparse
+import json
+import os
+import socketserver
+import sys
+import time
+import traceback
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import IndianaDrones as indiana
+
+
+SPOOL_STATES = ('incoming', 'working', 'done', 'results')
+
+
+class RenderService:
+
+    def __init__(self, local_folder=None, *, cache_folder=None):
+        self.id = indiana.IndianaDrones(local_folder, cache_folder=cache_folder)
+        self.id.load_objects()
+
+
+    def run_job(self, job):
+        """Render one job and describe the outcome"""
+        started = time.perf_counter()
+        result = {'id': job.get('id'), 'outputs': []}
+        try:
+            self.id.reset_dynamic_objects()
+            if job.get('sim'): self.id.sim_filepath = job['sim']
+            self.id.render_resumable = bool(job.get('resumable', False))
+            self.id.render_cameras = job.get('cameras')
+            self.id.create_camera_rigs()
+            number_takes = self.id.load_simulation()
+            output_folder = job.get('output')
+            
+            if job.get('timeline'):
+                self.id.create_timeline(job.get('takes'))
+                result['outputs'] += self.id.render_run(job.get('name', 'run'),
+                    output_folder=output_folder)
+            else:
+                takes = range(number_takes) if job.get('all_takes') else job.get('takes', [0])
+                for take in takes:
+                    self.id.create_animation(take)
+                    result['outputs'] += self.id.render_take(take, output_folder=output_folder)
+            result['status'] = 'done' if all(result['outputs']) else 'failed'
+        except Exception:
+            result['status'] = 'failed'
+            result['error'] = traceback.format_exc()
+        result['seconds'] = time.perf_counter() - started
+        return result
+
+
+    def serve_spool(self, spool_folder, *, poll_interval=.5):
+        for state in SPOOL_STATES:
+            os.makedirs(os.path.join(spool_folder, state), exist_ok=True)
+        print('Watching', os.path.join(spool_folder, 'incoming'))
+        while True:
+            job_filenames = sorted(f for f in os.listdir(os.path.join(spool_folder, 'incoming'))
+                if f.endswith('.json'))
+            if not job_filenames:
+                time.sleep(poll_interval)
+                continue
+            job_filename = job_filenames[0]
+            working_filepath = os.path.join(spool_folder, 'working', job_filename)
+            try:
+                os.rename(os.path.join(spool_folder, 'incoming', job_filename), working_filepath)
+            except OSError:
+                continue # taken by another service on the same spool
+            with open(working_filepath, 'r') as f:
+                job = json.load(f)
+            job.setdefault('id', job_filename[:-len('.json')])
+            
+            result = self.run_job(job)
+            print('Job', job['id'], result['status'], 'in', round(result['seconds'], 2), 's')
+            result_filepath = os.path.join(spool_folder, 'results', job_filename)
+            with open(result_filepath + '.tmp', 'w') as f:
+                json.dump(result, f)
+            os.replace(result_filepath + '.tmp', result_filepath)
+            os.replace(working_filepath, os.path.join(spool_folder, 'done', job_filename))
+
+
+    def serve_socket(self, port, *, host='127.0.0.1'):
+        service = self
+
+        class JobHandler(socketserver.StreamRequestHandler):
+            def handle(self):
+                job = json.loads(self.rfile.readline())
+                result = service.run_job(job)
+                self.wfile.write((json.dumps(result) + '\n').encode('utf-8'))
+
+        # jobs run one at a time on the main thread, as bpy requires
+        with socketserver.TCPServer((host, port), JobHandler) as server:
+            print('Listening on', host + ':' + str(port))
+            server.serve_forever()
+
+
+def parse_arguments(argv):
+    argv = argv[argv.index('--') + 1:] if '--' in argv else []
+    parser = argparse.ArgumentParser(prog='renderd')
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--spool', help='folder watched for job files')
+    source.add_argument('--port', type=int, help='local TCP port accepting JSON jobs')
+    parser.add_argument('--local-folder', help='folder of the assets, defaults to the script folder')
+    parser.add_argument('--cache-folder', help='folder of the asset and render caches, defaults to the local folder')
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    args = parse_arguments(sys.argv)
+    service = RenderService(args.local_folder, cache_folder=args.cache_folder)
+    if args.spool:
+        service.serve_spool(args.spool)
+    else:
+        service.serve_socket(args.port)
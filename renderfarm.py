@@ -0,0 +1,349 @@
+"""Render IndianaDrones takes or timeline frames on a pool of headless Blender workers.
+
+Jobs live as JSON files in a queue folder that can be shared between hosts:
+
+    python renderfarm.py submit --queue Q --output OUT --takes 0 35 --takes-per-job 4
+    python renderfarm.py work   --queue Q --blend scene.blend --concurrency 8 --threads 8
+    python renderfarm.py collect --queue Q --output OUT
+
+Each worker claims a job by renaming it from pending/ to running/ and keeps the
+lease alive while Blender runs. Jobs whose lease expires (dead worker or host)
+go back to pending/, so a shard is only done once all its outputs exist.
+Workers render with --resumable, so a retried shard continues from the
+frames its previous attempt already finished.
+"""
+import argparse
+import glob
+import json
+import os
+import re
+import socket
+import subprocess
+import sys
+import threading
+import time
+import uuid
+
+import video
+
+
+QUEUE_STATES = ('pending', 'running', 'done', 'failed')
+
+
+def local_folder():
+    return os.path.dirname(os.path.abspath(__file__))
+
+
+def take_jobs(take_start, take_end, takes_per_job, output_folder, *, sim_filepath=None):
+    """One job per group of consecutive takes, each take rendered to its own MP4"""
+    jobs = []
+    for first in range(take_start, take_end, takes_per_job):
+        takes = list(range(first, min(first + takes_per_job, take_end)))
+        args = ['--takes'] + [str(t) for t in takes] + ['--render', '--resumable',
+            '--output', output_folder]
+        if sim_filepath: args += ['--sim', sim_filepath]
+        jobs.append({
+            'id': 'takes_' + str(takes[0]).zfill(6),
+            'args': args,
+            'outputs': [os.path.join(output_folder, 'take_' + str(t).zfill(2) + '.mp4') for t in takes],
+        })
+    return jobs
+
+
+def frame_jobs(frame_start, frame_end, frames_per_job, output_folder, *, sim_filepath=None):
+    """One job per range of timeline frames, rendered as an image sequence"""
+    frames_folder = os.path.join(output_folder, 'frames')
+    jobs = []
+    for first in range(frame_start, frame_end + 1, frames_per_job):
+        last = min(first + frames_per_job - 1, frame_end)
+        args = ['--timeline', '--frame-range', str(first), str(last),
+            '--render', '--output', frames_folder]
+        if sim_filepath: args += ['--sim', sim_filepath]
+        jobs.append({
+            'id': 'frames_' + str(first).zfill(6),
+            'args': args,
+            'outputs': [os.path.join(frames_folder, str(f).zfill(5) + '.png')
+                for f in range(first, last + 1)],
+        })
+    return jobs
+
+
+# frame numbers as Blender writes them, zero-padded to four digits
+BLENDER_FRAME_RANGE = r'(\d{4}|[1-9]\d{4,})-(\d{4}|[1-9]\d{4,})'
+
+
+def find_output(filename):
+    """Rendered file, allowing for the frame range Blender may add to movie names.
+    Only that exact suffix is accepted, so take_10 never matches take_100."""
+    if os.path.exists(filename): return filename
+    root, extension = os.path.splitext(filename)
+    name_pattern = re.compile(re.escape(os.path.basename(root)) + BLENDER_FRAME_RANGE
+        + re.escape(extension) + '$')
+    candidates = sorted(c for c in glob.glob(glob.escape(root) + '*' + extension)
+        if name_pattern.match(os.path.basename(c)))
+    return candidates[0] if candidates else None
+
+
+def are_outputs_complete(job):
+    return all(find_output(o) is not None and os.path.getsize(find_output(o)) > 0
+        for o in job['outputs'])
+
+
+class JobQueue:
+    """Folder based job queue; renames within one file system are atomic"""
+
+    def __init__(self, queue_folder, *, max_attempts=3):
+        self.queue_folder = queue_folder
+        self.max_attempts = max_attempts
+        for state in QUEUE_STATES:
+            os.makedirs(os.path.join(queue_folder, state), exist_ok=True)
+
+
+    def path(self, state, job_id):
+        return os.path.join(self.queue_folder, state, job_id + '.json')
+
+
+    def job_ids(self, state):
+        return sorted(f[:-len('.json')] for f in os.listdir(os.path.join(self.queue_folder, state))
+            if f.endswith('.json'))
+
+
+    def write(self, state, job):
+        temporary_path = self.path(state, job['id']) + '.tmp'
+        with open(temporary_path, 'w') as f:
+            json.dump(job, f)
+        os.replace(temporary_path, self.path(state, job['id']))
+
+
+    def read(self, state, job_id):
+        with open(self.path(state, job_id), 'r') as f:
+            return json.load(f)
+
+
+    def submit(self, jobs):
+        for job in jobs:
+            job.setdefault('attempts', 0)
+            self.write('pending', job)
+        return len(jobs)
+
+
+    def claim(self, worker_id):
+        for job_id in self.job_ids('pending'):
+            try:
+                os.rename(self.path('pending', job_id), self.path('running', job_id))
+            except OSError:
+                continue # claimed by another worker
+            job = self.read('running', job_id)
+            job['worker'] = worker_id
+            self.write('running', job)
+            return job
+        return None
+
+
+    def heartbeat(self, job):
+        try:
+            os.utime(self.path('running', job['id']))
+        except OSError:
+            pass # lease was taken back, the job will run again
+
+
+    def take_running(self, job_id):
+        """Rename a running job out of running/ so no other worker can move it.
+        Returns the new path, or None when another worker took it first."""
+        claimed_path = self.path('running', job_id) + '.' + uuid.uuid4().hex + '.claim'
+        try:
+            os.rename(self.path('running', job_id), claimed_path)
+        except OSError:
+            return None
+        return claimed_path
+
+
+    def move(self, job, state):
+        claimed_path = self.take_running(job['id'])
+        if claimed_path is None: return False # requeued meanwhile
+        self.write(state, job)
+        os.remove(claimed_path)
+        return True
+
+
+    def complete(self, job):
+        return self.move(job, 'done')
+
+
+    def retry_state(self, job):
+        job['attempts'] = job.get('attempts', 0) + 1
+        return 'pending' if job['attempts'] < self.max_attempts else 'failed'
+
+
+    def fail(self, job):
+        return self.move(job, self.retry_state(job))
+
+
+    def requeue_stale(self, lease_timeout):
+        """Put back the jobs of workers that stopped renewing their lease"""
+        requeued = 0
+        for job_id in self.job_ids('running'):
+            try:
+                if time.time() - os.path.getmtime(self.path('running', job_id)) < lease_timeout: continue
+            except OSError:
+                continue
+            claimed_path = self.take_running(job_id)
+            if claimed_path is None: continue # requeued or finished by another worker
+            # renaming keeps the mtime, so a lease renewed since the check shows here
+            if time.time() - os.path.getmtime(claimed_path) < lease_timeout:
+                os.rename(claimed_path, self.path('running', job_id))
+                continue
+            with open(claimed_path, 'r') as f:
+                job = json.load(f)
+            self.write(self.retry_state(job), job)
+            os.remove(claimed_path)
+            requeued += 1
+        return requeued
+
+
+    def is_finished(self):
+        return not self.job_ids('pending') and not self.job_ids('running')
+
+
+def blender_command(job, *, blender='blender', blend_filepath=None, script_filepath=None, threads=0,
+        cache_folder=None):
+    script_filepath = script_filepath or os.path.join(local_folder(), 'IndianaDrones.py')
+    command = [blender, '-b']
+    if blend_filepath: command.append(blend_filepath)
+    command += ['-t', str(threads), '-P', script_filepath, '--'] + job['args']
+    if cache_folder: command += ['--cache-folder', cache_folder]
+    return command
+
+
+def run_job(queue, job, command, *, lease_timeout=300, log_folder=None):
+    """Run one job in a Blender subprocess while renewing its lease"""
+    finished = threading.Event()
+
+    def keep_lease():
+        while not finished.wait(lease_timeout / 3.):
+            queue.heartbeat(job)
+
+    heartbeat_thread = threading.Thread(target=keep_lease, daemon=True)
+    heartbeat_thread.start()
+    log_filepath = os.path.join(log_folder or os.path.join(queue.queue_folder, 'logs'), job['id'] + '.log')
+    os.makedirs(os.path.dirname(log_filepath), exist_ok=True)
+    try:
+        with open(log_filepath, 'w') as log:
+            return_code = subprocess.call(command, stdout=log, stderr=subprocess.STDOUT)
+    finally:
+        finished.set()
+        heartbeat_thread.join()
+
+    # Blender exits cleanly even when a render fails, so trust the files
+    if return_code == 0 and are_outputs_complete(job):
+        queue.complete(job)
+        return True
+    queue.fail(job)
+    return False
+
+
+def run_worker(queue, worker_id, *, lease_timeout=300, poll_interval=5., **command_options):
+    """Claim and run jobs until the queue has nothing pending or running"""
+    while True:
+        queue.requeue_stale(lease_timeout)
+        job = queue.claim(worker_id)
+        if job is None:
+            if queue.is_finished(): return
+            time.sleep(poll_interval)
+            continue
+        print(worker_id, 'rendering', job['id'])
+        run_job(queue, job, blender_command(job, **command_options), lease_timeout=lease_timeout)
+
+
+def run_workers(queue, *, concurrency=1, **worker_options):
+    """Run several workers on this host, each driving its own Blender process"""
+    host = socket.gethostname()
+    threads = [threading.Thread(target=run_worker,
+            args=(queue, host + '-' + str(os.getpid()) + '-' + str(w)), kwargs=worker_options)
+        for w in range(concurrency)]
+    for thread in threads: thread.start()
+    for thread in threads: thread.join()
+
+
+def collect(queue, output_folder, *, fps=10, ffmpeg='ffmpeg'):
+    """Join the outputs of all done jobs into one MP4.
+    Returns None while jobs are pending, running or failed, or when outputs are missing,
+    rather than writing a run with takes left out."""
+    if not queue.is_finished():
+        print('Not collecting, jobs pending or running:', queue.job_ids('pending') + queue.job_ids('running'))
+        return None
+    if queue.job_ids('failed'):
+        print('Not collecting, failed jobs:', queue.job_ids('failed'))
+        return None
+    jobs = [queue.read('done', job_id) for job_id in queue.job_ids('done')]
+    expected = [o for job in jobs for o in job['outputs']]
+    outputs = [find_output(o) for o in expected]
+    missing = [e for e, o in zip(expected, outputs) if o is None]
+    if not expected or missing:
+        print('Not collecting, missing outputs:', missing if missing else 'no done jobs')
+        return None
+    output_filename = os.path.join(output_folder, 'run.mp4')
+    if all(o.endswith('.png') for o in outputs):
+        frame_start = int(os.path.basename(outputs[0])[:-len('.png')])
+        pattern = os.path.join(os.path.dirname(outputs[0]), '%05d.png')
+        return video.encode_frames(pattern, output_filename, fps, frame_start=frame_start, ffmpeg=ffmpeg)
+    return video.concat_videos(outputs, output_filename, ffmpeg=ffmpeg)
+
+
+def parse_arguments(argv):
+    parser = argparse.ArgumentParser(prog='renderfarm')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    submit = commands.add_parser('submit', help='split a run into jobs')
+    submit.add_argument('--queue', required=True)
+    submit.add_argument('--output', required=True)
+    submit.add_argument('--sim')
+    submit.add_argument('--takes', type=int, nargs=2, metavar=('START', 'END'))
+    submit.add_argument('--takes-per-job', type=int, default=1)
+    submit.add_argument('--frames', type=int, nargs=2, metavar=('START', 'END'))
+    submit.add_argument('--frames-per-job', type=int, default=50)
+
+    work = commands.add_parser('work', help='run workers on this host')
+    work.add_argument('--queue', required=True)
+    work.add_argument('--blender', default='blender')
+    work.add_argument('--blend')
+    work.add_argument('--concurrency', type=int, default=1, help='Blender processes on this host')
+    work.add_argument('--threads', type=int, default=0, help='Blender threads per worker, 0 for all')
+    work.add_argument('--lease', type=float, default=300., help='seconds before a silent job is requeued')
+    work.add_argument('--cache-folder', help='asset and render caches shared by the workers')
+
+    join = commands.add_parser('collect', help='join rendered outputs into one MP4')
+    join.add_argument('--queue', required=True)
+    join.add_argument('--output', required=True)
+    join.add_argument('--fps', type=int, default=10)
+    join.add_argument('--ffmpeg', default='ffmpeg')
+    return parser.parse_args(argv)
+
+
+def main(argv):
+    args = parse_arguments(argv)
+    queue = JobQueue(args.queue)
+
+    if args.command == 'submit':
+        jobs = []
+        if args.takes:
+            jobs += take_jobs(args.takes[0], args.takes[1], args.takes_per_job, args.output,
+                sim_filepath=args.sim)
+        if args.frames:
+            jobs += frame_jobs(args.frames[0], args.frames[1], args.frames_per_job, args.output,
+                sim_filepath=args.sim)
+        print('Submitted', queue.submit(jobs), 'jobs')
+
+    elif args.command == 'work':
+        run_workers(queue, concurrency=args.concurrency, lease_timeout=args.lease,
+            blender=args.blender, blend_filepath=args.blend, threads=args.threads,
+            cache_folder=args.cache_folder)
+
+    elif args.command == 'collect':
+        output_filename = collect(queue, args.output, fps=args.fps, ffmpeg=args.ffmpeg)
+        if output_filename is None: sys.exit(1)
+        print('Wrote', output_filename)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,117 @@
+"""Scene plans: everything a take needs, computed without bpy.
+
+A plan holds the lane mesh, the obstacles to place and the robot keys of one
+take as NumPy arrays; obstacle ids and types are codes into the log's tables.
+plan_takes computes them in worker processes ahead of the take being rendered,
+so Blender's main thread only applies ready plans.
+"""
+import collections
+import contextlib
+import itertools
+import math
+import multiprocessing
+import sys
+
+import numpy as np
+
+import geometry
+import simlog
+
+
+class TakePlan:
+    """Precomputed scene of one take, in scene units"""
+
+    def __init__(self, take):
+        self.take = take
+        self.path = np.zeros((0, 2))
+        self.lane_vertices = None
+        self.lane_faces = None
+        self.lane_blocks = None # with incremental scene updates, see geometry.lane_blocks
+        self.obstacles = simlog.make_obstacles([], [], np.zeros((0, 2)), [])
+        self.robot_coordinates = None
+        self.robot_heading = 0.
+        self.next_robot_coordinates = None # None on the last take, which has no motion
+        self.next_robot_heading = None
+
+
+def plan_take(sim_data, take, settings):
+    """Plan of a take of a SimulationLog; settings come from IndianaDrones.plan_settings"""
+    plan = TakePlan(take)
+    record = sim_data.take(take)
+
+    plan.robot_coordinates = record.robot_coordinates
+    plan.robot_heading = record.robot_heading
+    if take + 1 < len(sim_data):
+        plan.next_robot_coordinates = sim_data.robot_coordinates(take + 1)
+        delta = plan.next_robot_coordinates - plan.robot_coordinates
+        plan.next_robot_heading = math.atan2(delta[1], delta[0])
+
+    plan.path = record.path
+    if settings['path_tolerance']:
+        plan.path = geometry.simplify_path(plan.path, settings['path_tolerance'])
+    if settings['path_mode'] == 'mesh' and settings['scene_update'] == 'incremental':
+        plan.lane_blocks = geometry.lane_blocks(plan.path, settings['path_wide'], settings['path_thick'])
+    elif settings['path_mode'] == 'mesh':
+        plan.lane_vertices, plan.lane_faces = geometry.lane_mesh(plan.path,
+            settings['path_wide'], settings['path_thick'])
+
+    plan.obstacles = record.obstacles
+    if settings['visible_area'] is not None:
+        footprints, bounds = settings['visible_area']
+        plan.obstacles = plan.obstacles[geometry.points_in_view(record.obstacle_coordinates(),
+            footprints, bounds, settings['culling_margin'])]
+    return plan
+
+
+_worker_sim_data = None
+_worker_settings = None
+
+
+def init_worker(settings):
+    global _worker_sim_data, _worker_settings
+    _worker_settings = settings
+    _worker_sim_data = simlog.SimulationLog(settings['sim_filepath'], settings['sim_scale'])
+
+
+def plan_take_in_worker(take):
+    return plan_take(_worker_sim_data, take, _worker_settings)
+
+
+@contextlib.contextmanager
+def hidden_main_module():
+    """Spawned processes import the parent's __main__ again, which inside Blender is
+    a script importing bpy; hide it while the workers start"""
+    main_module = sys.modules['__main__']
+    main_file = main_module.__dict__.pop('__file__', None)
+    main_spec, main_module.__spec__ = getattr(main_module, '__spec__', None), None
+    try:
+        yield
+    finally:
+        if main_file is not None: main_module.__file__ = main_file
+        main_module.__spec__ = main_spec
+
+
+def plan_takes(settings, takes, *, processes=2, lookahead=4):
+    """Plans of the takes, in order, computed by a pool of processes ahead of the consumer.
+    At most lookahead plans (at least one) are computed or waiting beyond the one being used."""
+    takes = iter(list(takes))
+    if processes <= 0:
+        sim_data = simlog.SimulationLog(settings['sim_filepath'], settings['sim_scale'])
+        for take in takes:
+            yield plan_take(sim_data, take, settings)
+        return
+
+    with hidden_main_module():
+        pool = multiprocessing.get_context('spawn').Pool(processes,
+            initializer=init_worker, initargs=(settings,))
+    try:
+        pending = collections.deque(pool.apply_async(plan_take_in_worker, (take,))
+            for take in itertools.islice(takes, max(lookahead, 1)))
+        while pending:
+            plan = pending.popleft().get()
+            for take in itertools.islice(takes, 1):
+                pending.append(pool.apply_async(plan_take_in_worker, (take,)))
+            yield plan
+    finally:
+        pool.terminate()
+        pool.join()
@@ -0,0 +1,298 @@
+import json
+import os
+import shutil
+import socket
+import time
+import uuid
+
+import numpy as np
+
+
+CACHE_VERSION = 1
+
+ARRAY_NAMES = (
+    'robot',                 # (takes, 3) x, y, heading
+    'obstacle_offsets',      # (takes + 1,) rows of each take in the obstacle table
+    'obstacle_ids',          # (obstacles,) index into id_table
+    'obstacle_types',        # (obstacles,) index into type_table
+    'obstacle_coordinates',  # (obstacles, 2)
+    'obstacle_radius',       # (obstacles,)
+    'path_offsets',          # (takes + 1,) rows of each take in the path table
+    'path',                  # (points, 2)
+    'id_table',              # (unique ids,) original obstacle ids
+    'type_table',            # (unique types,) obstacle type letters
+)
+
+
+OBSTACLE_DTYPE = np.dtype([
+    ('id', np.int32),      # index into the log's id table
+    ('type', np.uint8),    # index into the log's type table
+    ('x', np.float64),
+    ('y', np.float64),
+    ('radius', np.float64),
+])
+
+
+class Take:
+    """One simulation record in scene units, as arrays"""
+    __slots__ = ('index', 'robot_coordinates', 'robot_heading', 'obstacles', 'path')
+
+    def __init__(self, index, robot_coordinates, robot_heading, obstacles, path):
+        self.index = index
+        self.robot_coordinates = robot_coordinates # (2,)
+        self.robot_heading = robot_heading
+        self.obstacles = obstacles # (obstacles,) of OBSTACLE_DTYPE
+        self.path = path # (points, 2)
+
+
+    def obstacle_coordinates(self):
+        return np.column_stack((self.obstacles['x'], self.obstacles['y']))
+
+
+    def digest_data(self, id_table, type_table):
+        """JSON-serializable content, for cache keys. Codes are numbered per log, so
+        obstacles are given by their original ids and type letters."""
+        obstacles = zip(np.asarray(id_table)[self.obstacles['id']].tolist(),
+                        np.asarray(type_table)[self.obstacles['type']].tolist(),
+                        self.obstacles['x'].tolist(), self.obstacles['y'].tolist(),
+                        self.obstacles['radius'].tolist())
+        return {'robot': self.robot_coordinates.tolist() + [self.robot_heading],
+                'obstacles': [list(o) for o in obstacles], 'path': self.path.tolist()}
+
+
+def make_obstacles(ids, types, coordinates, radius):
+    obstacles = np.empty(len(ids), dtype=OBSTACLE_DTYPE)
+    obstacles['id'] = ids
+    obstacles['type'] = types
+    obstacles['x'] = coordinates[:, 0]
+    obstacles['y'] = coordinates[:, 1]
+    obstacles['radius'] = radius
+    return obstacles
+
+
+def default_cache_folder(sim_filepath):
+    return sim_filepath + '.cache'
+
+
+def source_signature(sim_filepath):
+    stat = os.stat(sim_filepath)
+    return {'version': CACHE_VERSION, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+def is_cache_valid(sim_filepath, cache_folder):
+    meta_filepath = os.path.join(cache_folder, 'meta.json')
+    if not os.path.exists(meta_filepath): return False
+    with open(meta_filepath, 'r') as f:
+        return json.load(f) == source_signature(sim_filepath)
+
+
+def parse_records(lines):
+    """Columns of a JSON-lines simulation log, in simulation units"""
+    robot, obstacle_offsets, path_offsets = [], [0], [0]
+    obstacle_ids, obstacle_types, obstacle_coordinates, obstacle_radius = [], [], [], []
+    path = []
+    id_codes, type_codes = {}, {}
+
+    for line in lines:
+        if not line.strip(): continue
+        record = json.loads(line)
+        for sim_obj_name, sim_attrs in record.items():
+            if sim_obj_name == 'self':
+                robot.append(sim_attrs['coordinates'][:2] + [sim_attrs['heading']])
+            elif sim_obj_name == 'path':
+                path.extend(p[:2] for p in sim_attrs)
+            else:
+                obstacle_ids.append(id_codes.setdefault(sim_obj_name, len(id_codes)))
+                obstacle_types.append(type_codes.setdefault(sim_attrs['type'], len(type_codes)))
+                obstacle_coordinates.append(sim_attrs['coordinates'][:2])
+                obstacle_radius.append(sim_attrs['radius'])
+        obstacle_offsets.append(len(obstacle_ids))
+        path_offsets.append(len(path))
+
+    return {
+        'robot': np.array(robot, dtype=np.float64).reshape(-1, 3),
+        'obstacle_offsets': np.array(obstacle_offsets, dtype=np.int64),
+        'obstacle_ids': np.array(obstacle_ids, dtype=np.int32),
+        'obstacle_types': np.array(obstacle_types, dtype=np.uint8),
+        'obstacle_coordinates': np.array(obstacle_coordinates, dtype=np.float64).reshape(-1, 2),
+        'obstacle_radius': np.array(obstacle_radius, dtype=np.float64),
+        'path_offsets': np.array(path_offsets, dtype=np.int64),
+        'path': np.array(path, dtype=np.float64).reshape(-1, 2),
+        'id_table': np.array(list(id_codes), dtype=str),
+        'type_table': np.array(list(type_codes), dtype=str),
+    }
+
+
+class RecordParser:
+    """Turns JSON-lines records into Takes, coding ids and types as they first appear"""
+
+    def __init__(self, scale=1.):
+        self.scale = scale
+        self.id_codes = {}
+        self.type_codes = {}
+        self.id_table = []
+        self.type_table = []
+        self.takes = 0
+
+
+    def code(self, codes, table, value):
+        code = codes.get(value)
+        if code is None:
+            code = codes[value] = len(table)
+            table.append(value)
+        return code
+
+
+    def parse(self, line):
+        columns = parse_records([line])
+        ids = [self.code(self.id_codes, self.id_table, str(i))
+            for i in columns['id_table'][columns['obstacle_ids']]]
+        types = [self.code(self.type_codes, self.type_table, str(t))
+            for t in columns['type_table'][columns['obstacle_types']]]
+        robot = columns['robot'][0] if len(columns['robot']) else np.zeros(3)
+        take = Take(self.takes, robot[:2] * self.scale, float(robot[2]),
+            make_obstacles(ids, types, columns['obstacle_coordinates'] * self.scale,
+                columns['obstacle_radius'] * self.scale),
+            columns['path'] * self.scale)
+        self.takes += 1
+        return take
+
+
+def open_stream(source):
+    """Text stream of a log source and whether it must be polled for growth"""
+    if hasattr(source, 'readline'): return source, False
+    if source.startswith('tcp://'):
+        host, port = source[len('tcp://'):].rsplit(':', 1)
+        return socket.create_connection((host, int(port))).makefile('r', encoding='utf-8'), False
+    # regular files are polled, pipes block until the writer sends more
+    return open(source, 'r', encoding='utf-8'), os.path.isfile(source)
+
+
+def follow_lines(source, *, poll_interval=.05, stop=None):
+    """Complete lines of a log while it is being written.
+    source is a file path, a named pipe, 'tcp://host:port' or an open text stream.
+    A partial line is held until its newline arrives. Files are followed until
+    stop() returns True; pipes and sockets end when the writer closes them."""
+    stream, polled = open_stream(source)
+    partial = ''
+    try:
+        while not (stop and stop()):
+            line = stream.readline()
+            if not line:
+                if not polled: break
+                time.sleep(poll_interval)
+                continue
+            partial += line
+            if partial.endswith('\n'):
+                if partial.strip(): yield partial
+                partial = ''
+        if partial.strip() and not polled: yield partial # writer closed without a newline
+    finally:
+        if stream is not source: stream.close()
+
+
+def follow(source, scale=1., *, parser=None, **options):
+    """Takes of a running simulation, as they are written; the parser holds the code tables"""
+    parser = parser or RecordParser(scale)
+    for line in follow_lines(source, **options):
+        yield parser.parse(line)
+
+
+def convert(sim_filepath, cache_folder=None):
+    """Convert a JSON-lines log into one .npy file per column.
+    The cache is written into a temporary sibling folder and renamed into place,
+    so processes converting the same log at once never read each other's files;
+    the first to finish wins and the others use its cache."""
+    cache_folder = cache_folder or default_cache_folder(sim_filepath)
+    temporary_folder = cache_folder + '.tmp-' + uuid.uuid4().hex
+    os.makedirs(temporary_folder)
+    try:
+        signature = source_signature(sim_filepath)
+        with open(sim_filepath, 'r') as f:
+            columns = parse_records(f)
+        for name in ARRAY_NAMES:
+            np.save(os.path.join(temporary_folder, name + '.npy'), columns[name])
+        with open(os.path.join(temporary_folder, 'meta.json'), 'w') as f:
+            json.dump(signature, f)
+
+        if is_cache_valid(sim_filepath, cache_folder): return cache_folder # converted meanwhile
+        # a stale cache is renamed away first, as only an empty folder can be replaced
+        stale_folder = cache_folder + '.old-' + uuid.uuid4().hex
+        try:
+            os.rename(cache_folder, stale_folder)
+        except OSError:
+            stale_folder = None # missing, or moved by another process
+        try:
+            os.replace(temporary_folder, cache_folder)
+        except OSError:
+            if not is_cache_valid(sim_filepath, cache_folder): raise
+        if stale_folder: shutil.rmtree(stale_folder, ignore_errors=True)
+    finally:
+        shutil.rmtree(temporary_folder, ignore_errors=True)
+    return cache_folder
+
+
+class SimulationLog:
+    """Columnar view of a simulation log, memory-mapped from its cache.
+    Indexing returns one take in the original record layout, scaled to the scene."""
+
+    def __init__(self, sim_filepath, scale=1., *, cache_folder=None, mmap=True):
+        self.sim_filepath = sim_filepath
+        self.scale = scale
+        self.cache_folder = cache_folder or default_cache_folder(sim_filepath)
+        if not is_cache_valid(sim_filepath, self.cache_folder):
+            convert(sim_filepath, self.cache_folder)
+
+        mmap_mode = 'r' if mmap else None
+        for name in ARRAY_NAMES:
+            setattr(self, name, np.load(os.path.join(self.cache_folder, name + '.npy'),
+                mmap_mode=mmap_mode))
+
+
+    def __len__(self):
+        return len(self.robot)
+
+
+    def __getitem__(self, take):
+        if take < 0: take += len(self)
+        record = {'self': {'coordinates': self.robot_coordinates(take).tolist(),
+                           'heading': self.robot_heading(take)}}
+
+        rows = self.obstacle_rows(take)
+        coordinates = np.asarray(self.obstacle_coordinates[rows]) * self.scale
+        radius = np.asarray(self.obstacle_radius[rows]) * self.scale
+        for id, obstacle_type, c, r in zip(self.id_table[self.obstacle_ids[rows]],
+                                           self.type_table[self.obstacle_types[rows]],
+                                           coordinates.tolist(), radius.tolist()):
+            record[str(id)] = {'coordinates': c, 'type': str(obstacle_type), 'radius': r}
+
+        record['path'] = self.take_path(take).tolist()
+        return record
+
+
+    def take(self, take):
+        """Take in scene units, its obstacles coded by the log's id and type tables"""
+        if take < 0: take += len(self)
+        rows = self.obstacle_rows(take)
+        obstacles = make_obstacles(self.obstacle_ids[rows], self.obstacle_types[rows],
+            np.asarray(self.obstacle_coordinates[rows]) * self.scale,
+            np.asarray(self.obstacle_radius[rows]) * self.scale)
+        return Take(take, self.robot_coordinates(take), self.robot_heading(take),
+            obstacles, self.take_path(take))
+
+
+    def obstacle_rows(self, take):
+        return slice(self.obstacle_offsets[take], self.obstacle_offsets[take + 1])
+
+
+    def robot_coordinates(self, take):
+        return np.asarray(self.robot[take, :2]) * self.scale
+
+
+    def robot_heading(self, take):
+        return float(self.robot[take, 2])
+
+
+    def take_path(self, take):
+        rows = slice(self.path_offsets[take], self.path_offsets[take + 1])
+        return np.asarray(self.path[rows]) * self.scale
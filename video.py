@@ -0,0 +1,27 @@
+import os
+import subprocess
+import tempfile
+
+
+def encode_frames(frames_pattern, output_filename, fps=10, *, frame_start=0, ffmpeg='ffmpeg'):
+    """Encode an image sequence such as 'frames/%05d.png' into an H.264 MP4"""
+    command = [ffmpeg, '-y', '-loglevel', 'error', '-framerate', str(fps),
+        '-start_number', str(frame_start), '-i', frames_pattern,
+        '-c:v', 'libx264', '-pix_fmt', 'yuv420p', output_filename]
+    subprocess.run(command, check=True)
+    return output_filename
+
+
+def concat_videos(video_filenames, output_filename, *, ffmpeg='ffmpeg'):
+    """Join videos with the same encoding, in order, without re-encoding"""
+    with tempfile.NamedTemporaryFile('w', suffix='.txt', delete=False) as f:
+        for video_filename in video_filenames:
+            f.write("file '" + os.path.abspath(video_filename).replace("'", "'\\''") + "'\n")
+        list_filename = f.name
+    try:
+        command = [ffmpeg, '-y', '-loglevel', 'error', '-f', 'concat', '-safe', '0',
+            '-i', list_filename, '-c', 'copy', output_filename]
+        subprocess.run(command, check=True)
+    finally:
+        os.remove(list_filename)
+    return output_filename